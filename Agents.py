@@ -1,6 +1,7 @@
 import math
-import random
 
+import numpy as np
+from scipy.spatial.distance import cdist
 from mesa.experimental.continuous_space.continuous_space_agents import ContinuousSpace, ContinuousSpaceAgent
 
 EAST = 0
@@ -14,9 +15,27 @@ STOP_RADIUS = 1
 SLOW_DOWN_RADIUS = 2.5
 TIME_TO_PRODUCE_TRASH = 20
 
+# Closest band that a human in front of the robot is in, the value of Robot.close_to_human
+CLEAR_BAND = 0
+SLOW_BAND = 1
+STOP_BAND = 2
+
+# Largest distance a human moves in one step relative to its speed. A human heading to a trash spot steps onto the
+# spot once it is within one step
+HUMAN_REACH = 2
+# Margin on the distance to the nearest human that covers rounding of positions
+CLEARANCE_MARGIN = 1e-6
+
+# Kinds of agents in the kind array of an IndexedSpace, see Kernels.py
+OTHER_KIND = 0
+HUMAN_KIND = 1
+TRASH_KIND = 2
+ROBOT_KIND = 3
+
 MEDIUM_TRASH = 4
 BIG_TRASH = 10
 
+# Times of day in steps from the start of a day. Every day of the simulation starts at 6:00 AM
 LUNCH_START_TIME = 216000 # Given that simulation starts at 6:00 AM, lunch starts at 12:00 PM (216000 is 6h in deciseconds)
 LUNCH_END_TIME = 288000 # Lunch ends at 2:00 PM
 DINNER_START_TIME = 468000 # Dinner starts at 7:00 PM
@@ -28,6 +47,9 @@ STEPS_IN_MINUTE = 60*STEPS_IN_SECONDS
 STEPS_IN_HOUR = 60*STEPS_IN_MINUTE
 STEPS_IN_DAY = 24*STEPS_IN_HOUR
 
+# Maximum number of steps for which the robot skips the check for people in front
+MAX_CLEAR_STEPS = STEPS_IN_MINUTE
+
 class DirectionalAgent(ContinuousSpaceAgent):
     """Class with common functionality for agent that have direction.
 
@@ -50,6 +72,10 @@ class DirectionalAgent(ContinuousSpaceAgent):
 
 
     def move_straight(self, speed):
+        kernels = self.model.kernels
+        if kernels is not None and kernels.compiled:
+            kernels.move_straight(self, speed)
+            return
 
         # Define agent direction in radians and displacement proportion in x and y directions
         radian_direction = 2 * math.pi * (self.direction / 360)
@@ -70,10 +96,16 @@ class DirectionalAgent(ContinuousSpaceAgent):
         self.position[1] = new_y
 
     def distance_to(self, agent: ContinuousSpaceAgent):
+        kernels = self.model.kernels
+        if kernels is not None and kernels.compiled:
+            return kernels.distance(self, agent)
         return math.sqrt(math.pow(self.position[0] - agent.position[0], 2) + math.pow(self.position[1] - agent.position[1], 2))
 
     # Get smallest (can be negative) angle between current direction and direction towards the position pos
     def get_angle_towards(self, pos):
+        kernels = self.model.kernels
+        if kernels is not None and kernels.compiled:
+            return kernels.angle_towards(self, pos)
         angle = 360 * math.atan2(pos[1] - self.position[1], pos[0] - self.position[0]) / (2 * math.pi)
 
         angle_diff = angle - self.direction
@@ -92,6 +124,7 @@ class Robot(DirectionalAgent):
         space: Continue space that the robot is part of
         max_speed: Maximum speed that the robot can attain in meters per decisecond (0.1 second)
         capacity: Number of trash units that the robot can fit
+        launch_delay: Number of steps the robot waits off-screen before its first loop
     """
     def __init__(self,
                  model,
@@ -99,7 +132,8 @@ class Robot(DirectionalAgent):
                  max_speed = 10,
                  capacity = 100,
                  visibility = 10,
-                 off_screen_steps = STEPS_IN_HOUR):
+                 off_screen_steps = STEPS_IN_HOUR,
+                 launch_delay = 0):
 
         # Robot initially looking rightwards.
         super().__init__(space, model, initial_direction=EAST, max_rotation=2)
@@ -133,14 +167,16 @@ class Robot(DirectionalAgent):
 
         # Amount of trash cleaned by robot from the start of simulation
         self.trash_cleaned = 0
-        # Time left to charge
-        self.time_to_charge = 0
+        # Time left to charge, robots of a fleet are launched one after another
+        self.time_to_charge = launch_delay
 
         # Presence field required for pie chart of disturbance measure
-        self.present = True
+        self.present = launch_delay == 0
 
         #  Whether the robot is close to a human in the current step
-        self.close_to_human = 0
+        self.close_to_human = CLEAR_BAND
+        # Number of next steps in which no human can come within SLOW_DOWN_RADIUS of the robot
+        self.clear_steps = 0
 
     # Actions of the robot on each step of the model
     def step(self):
@@ -152,10 +188,14 @@ class Robot(DirectionalAgent):
         # Choosing the next target if there is none and there is place in the robot left
         from Algorithm import choose_next_target
         if self.fullness < self.capacity and self.target_trash is None:
-            agents_nearby, _ = self.get_neighbors_in_radius(self.visibility)
-            trash_in_front = [agent for agent in agents_nearby if isinstance(agent, Trash)
-                              and agent.position[0] > self.position[0]]
-            self.target_trash = choose_next_target(self, trash_in_front)
+            if self.model.kernels is not None:
+                trash_in_front, _ = self.model.kernels.within(self, self.visibility, TRASH_KIND, x_sign=-1)
+            else:
+                agents_nearby, _ = self.get_neighbors_in_radius(self.visibility)
+                trash_in_front = [agent for agent in agents_nearby if isinstance(agent, Trash)
+                                  and agent.position[0] > self.position[0]]
+            # Spots claimed by other robots of the fleet are not considered
+            self.set_target(choose_next_target(self, self.model.claims.unclaimed(self, trash_in_front)))
 
         target_pos = None
         speed = self.max_speed
@@ -173,19 +213,21 @@ class Robot(DirectionalAgent):
 
         # Adjust speed depending on people nearby
         speed = self.adjust_speed(speed)
+        self.model.heatmaps.record_disturbance(self.position, self.close_to_human)
 
         # Move towards chosen position with chosen speed
         self.move(speed, target_pos)
 
         # Trash was missed (most probably due to robot being unable to change direction quick enough)
         if self.target_trash is not None and self.position[0] > self.target_trash.position[0]:
-            self.target_trash = None
+            self.set_target(None)
 
         # Robot is getting emptied and charges when reached the end of loop
         if self.position[0] > (self.space.width + self.X_COORD_OFFSET):
             self.time_to_charge = self.off_screen_steps
             self.fullness = 0
             self.present = False
+            self.clear_steps = 0
 
         self.time_passed += 1
 
@@ -216,8 +258,11 @@ class Robot(DirectionalAgent):
         sweeping_radius = self.slow_speed
 
         # Get all trash in the radius
-        agents_nearby, _ = self.get_neighbors_in_radius(sweeping_radius)
-        trash_nearby = [agent for agent in agents_nearby if isinstance(agent, Trash)]
+        if self.model.kernels is not None:
+            trash_nearby, _ = self.model.kernels.within(self, sweeping_radius, TRASH_KIND)
+        else:
+            agents_nearby, _ = self.get_neighbors_in_radius(sweeping_radius)
+            trash_nearby = [agent for agent in agents_nearby if isinstance(agent, Trash)]
 
         # Remove all the trash nearby
         for trash in trash_nearby:
@@ -232,7 +277,20 @@ class Robot(DirectionalAgent):
             # Remove trash agent
             trash.remove()
             # Reset target trash
-            self.target_trash = None
+            self.set_target(None)
+
+    # Target given trash spot, or no spot if None. A spot claimed by another robot of the fleet can not be targeted
+    def set_target(self, trash):
+        claims = self.model.claims
+        if self.target_trash is not None:
+            claims.unclaim(self, self.target_trash)
+        if trash is not None and not claims.claim(self, trash):
+            trash = None
+        self.target_trash = trash
+
+    def remove(self):
+        self.set_target(None)
+        super().remove()
 
 
     def charge(self):
@@ -244,22 +302,54 @@ class Robot(DirectionalAgent):
 
 
     def adjust_speed(self, speed):
-        agents_very_close, _ = self.get_neighbors_in_radius(STOP_RADIUS)
-        people_front_close = [agent for agent in agents_very_close if isinstance(agent, Human)
-                              and abs(self.get_angle_towards(agent.position)) <= 90]
-        if len(people_front_close) > 0:
-            self.close_to_human = 2
+        self.close_to_human = self.people_in_front()
+        if self.close_to_human == STOP_BAND:
             return 0
-
-        agents_nearby, _ = self.get_neighbors_in_radius(SLOW_DOWN_RADIUS)
-        people_front_nearby = [agent for agent in agents_nearby if isinstance(agent, Human)
-                              and abs(self.get_angle_towards(agent.position)) <= 90]
-        if len(people_front_nearby) > 0:
-            self.close_to_human = 1
+        if self.close_to_human == SLOW_BAND:
             return self.slow_speed
+        return speed
+
+    """Closest band that a human in front of the robot is in: STOP_BAND within STOP_RADIUS, SLOW_BAND within
+    SLOW_DOWN_RADIUS, CLEAR_BAND otherwise. Distances are taken to the humans only, from the human rows of the
+    space, and only the humans within SLOW_DOWN_RADIUS are classified. If the
+    street is clear, the check is skipped for as many steps as the nearest human needs to come within
+    SLOW_DOWN_RADIUS of the path of the robot, moving towards each other at full speed.
+    """
+    def people_in_front(self):
+        if self.clear_steps > 0:
+            self.clear_steps -= 1
+            return CLEAR_BAND
+
+        if self.model.kernels is not None:
+            band, nearest = self.model.kernels.front_band(self, STOP_RADIUS, SLOW_DOWN_RADIUS)
         else:
-            self.close_to_human = 0
-            return speed
+            # Distances are computed like ContinuousSpace.calculate_distances does
+            humans = self.space.agent_positions[self.space.indices_of(HUMAN_KIND)]
+            distances = cdist(self.position[np.newaxis, :], humans)[0, :]
+            band = CLEAR_BAND
+            nearest = distances.min() if len(distances) > 0 else math.inf
+            for i in np.flatnonzero(distances <= SLOW_DOWN_RADIUS).tolist():
+                if abs(self.get_angle_towards(humans[i])) <= 90:
+                    if distances[i] <= STOP_RADIUS:
+                        band = STOP_BAND
+                        break
+                    band = SLOW_BAND
+
+        if band == CLEAR_BAND:
+            clearance = (nearest - SLOW_DOWN_RADIUS - CLEARANCE_MARGIN) / self.reach()
+            self.clear_steps = int(min(clearance, MAX_CLEAR_STEPS))
+        return band
+
+    # Largest distance by which the robot and a human get closer in one step
+    def reach(self):
+        return self.max_speed + HUMAN_REACH * self.model.human_speed
+
+    # A human appeared on the street. If the human is close enough to come within SLOW_DOWN_RADIUS of the robot while
+    # it skips the check for people in front, the robot checks again in its next step
+    def human_appeared(self, human):
+        if self.clear_steps > 0 and (self.distance_to(human) - self.clear_steps * self.reach()
+                                     <= SLOW_DOWN_RADIUS + CLEARANCE_MARGIN):
+            self.clear_steps = 0
 
 
 class TrashCar(ContinuousSpaceAgent):
@@ -325,15 +415,19 @@ class Human(DirectionalAgent):
 
         self.X_COORD_OFFSET = space.width // 5
 
+        # Random streams of the human for walking and for littering. Every spawned human gets its own streams from the
+        # model, so that runs with the same seed see the same pedestrians and litter however the street is cleaned
+        self.walk_random, self.litter_random = model.human_streams()
+
         # Direction that the human faces counting from rightwards direction counterclockwise in degrees
         direction_for_given_x_coord = 0 if x_coord == -self.X_COORD_OFFSET else 180
-        initial_direction = random.randint(0, 1) * 180 if x_coord is None else direction_for_given_x_coord
+        initial_direction = self.walk_random.randint(0, 1) * 180 if x_coord is None else direction_for_given_x_coord
 
         super().__init__(space, model, initial_direction=initial_direction, max_rotation=5)
 
         # Initial position of the human
-        self.position[0] = random.uniform(0, self.space.width) if x_coord is None else x_coord
-        self.position[1] = random.uniform(0, self.space.height)
+        self.position[0] = self.walk_random.uniform(0, self.space.width) if x_coord is None else x_coord
+        self.position[1] = self.walk_random.uniform(0, self.space.height)
 
         # Walking speed of the human
         self.speed = speed
@@ -355,18 +449,22 @@ class Human(DirectionalAgent):
         self.nearest_trash: Trash | None = None
         self.wait = 0
 
+        self.appear()
+
+    # Robots that skip the check for people in front check whether the human appeared close to them
+    def appear(self):
+        for robot in self.model.agents_by_type.get(Robot, []):
+            robot.human_appeared(self)
+
     def step(self):
         self.wait -= 1
         self.move(self.speed)
 
         # Littering rate is increased during lunch and dinner time
-        if LUNCH_START_TIME <= self.model.steps < LUNCH_END_TIME or DINNER_START_TIME <= self.model.steps < DINNER_END_TIME:
-            littering_rate = self.initial_littering_rate * 3
-        else:
-            littering_rate = self.initial_littering_rate
+        littering_rate = self.initial_littering_rate * littering_multiplier(self.model.steps % STEPS_IN_DAY)
 
         # Litter
-        if random.uniform(0, 1) < littering_rate:
+        if self.litter_random.uniform(0, 1) < littering_rate:
             self.wants_to_litter = True
             self.nearest_trash = self.get_nearest_trash(LITTER_SEEK_RADIUS)
 
@@ -378,7 +476,7 @@ class Human(DirectionalAgent):
         
         # If the human is out of bounds of street, remove it and generate a new human
         if not -self.X_COORD_OFFSET < self.position[0] < self.space.width + self.X_COORD_OFFSET:
-            random_x_coord = (self.space.width + 2 * self.X_COORD_OFFSET) * random.randint(0, 1) - self.X_COORD_OFFSET
+            random_x_coord = (self.space.width + 2 * self.X_COORD_OFFSET) * self.walk_random.randint(0, 1) - self.X_COORD_OFFSET
 
             Human.create_agents(
                     self.model,
@@ -401,7 +499,7 @@ class Human(DirectionalAgent):
         if not self.wants_to_litter:
 
             # Minimally change direction to make walking seem less automated
-            self.direction = (self.direction + random.uniform(-5*self.average_rotation, 5*self.average_rotation)) % 360
+            self.direction = (self.direction + self.walk_random.uniform(-5*self.average_rotation, 5*self.average_rotation)) % 360
 
 
             # Update direction if human gets too close to street edge 
@@ -461,6 +559,12 @@ class Human(DirectionalAgent):
 
 
     def litter(self):
+        # With coalescing enabled, trash thrown close to an existing spot joins the spot
+        from Coalescing import litter_into_nearby_spot
+        if self.model.trash_grid is not None and litter_into_nearby_spot(self.model, self.position):
+            self.wants_to_litter = False
+            return
+
         Trash.create_agents(
             self.model,
             1,
@@ -480,8 +584,11 @@ class Human(DirectionalAgent):
         Returns:
             The nearest Human or RObot, or None if none are found.
         """
-        all_neighbors = self.get_neighbors_in_radius(radius)
         x = 1 if self.destination == 0 else -1
+        if self.model.kernels is not None:
+            return self.model.kernels.nearest(self, radius, HUMAN_KIND, x_sign=x)
+
+        all_neighbors = self.get_neighbors_in_radius(radius)
 
         # Filter agents by type
         human_neighbors = [agent for agent in all_neighbors[0] if isinstance(agent, Human) and x*(self.position[0] - agent.position[0]) > 0]
@@ -505,6 +612,9 @@ class Human(DirectionalAgent):
         Returns:
             The nearest Trash in radius, or None if none are found.
         """
+        if self.model.kernels is not None:
+            return self.model.kernels.nearest(self, radius, TRASH_KIND)
+
         all_neighbors = self.get_neighbors_in_radius(radius)
 
         # Filter agents by type
@@ -538,13 +648,38 @@ class Trash(ContinuousSpaceAgent):
         self.position[1] = y_coord
         # Size of the trash spot. One unit of trash can be considered as one cup or food packaging
         self.size = 0
+        # Step at which the size of the spot last changed, required for the trash dwell time heatmap
+        self.last_change = model.steps
         self.increase()
 
+        if model.trash_grid is not None:
+            model.trash_grid.add(self)
+
     # Increase amount of trash in the spot by one unit
     def increase(self):
+        self.model.heatmaps.record_dwell(self.position, self.size, self.last_change, self.model.steps)
+        self.last_change = self.model.steps
+        self.model.heatmaps.record_litter(self.position)
+
         self.size += 1
         self.model.total_trash_produced += 1
 
+    # Remove the trash spot from the street when it is cleaned
+    def remove(self):
+        self.model.heatmaps.record_dwell(self.position, self.size, self.last_change, self.model.steps)
+        if self.model.trash_grid is not None:
+            self.model.trash_grid.remove(self)
+        self.model.claims.release(self)
+        super().remove()
+
+
+# Multiplier of the littering rate at given time of day in steps, people litter three times as much during lunch
+# and dinner
+def littering_multiplier(time_of_day):
+    if LUNCH_START_TIME <= time_of_day < LUNCH_END_TIME or DINNER_START_TIME <= time_of_day < DINNER_END_TIME:
+        return 3
+    return 1
+
 
 def sign(x):
     return 2 * (x >= 0) - 1
\ No newline at end of file
@@ -63,6 +63,9 @@ def trash_score(robot: Robot, trash: Trash) -> float:
 
 # Chooses next trash spot to clean - the spot with the highest score
 def choose_next_target(robot: Robot, trash_spots):
+    if robot.model.kernels is not None:
+        return robot.model.kernels.choose_next_target(robot, trash_spots)
+
     best_trash = None
     best_score = float('-inf')
     for trash in trash_spots:
@@ -1,59 +1,10 @@
-from Agents import Robot, Human, Trash, TrashCar
-from Model import TrashCollection
-from matplotlib.axes import Axes
-from mesa.visualization import (
-    SolaraViz,
-    make_space_component,
-)
+import os
 
-# Function to portray the agents. Defines visual properties of each agent.
-def trash_collection_portrayal(agent):
-    if agent is None:
-        return
-
-    # Defines size of agents
-    portrayal: dict[str, int | str] = {
-        "size": 150,
-    }
-
-    # Defines color and shape of the robot
-    # For now robot is a blue square
-    if isinstance(agent, Robot):
-        portrayal["color"] = "tab:blue"
-        portrayal["marker"] = "s"
-        portrayal["zorder"] = 3
-
-    # Defines color and shape of humans
-    # For now each human is an orange circle
-    if isinstance(agent, Human):
-        portrayal["color"] = "tab:orange"
-        portrayal["marker"] = "o"
-        portrayal["zorder"] = 2
-
-
-    # Defines color and shape of trash spots
-    # For now each trash spot is a grey cross
-    if isinstance(agent, Trash):
-        
-        portrayal["marker"] = "X"
-        portrayal["zorder"] = 1
-
-        # As Trash "size" increases its marker's size increases and its color gets darker.
-        portrayal["size"] = 150 + 30 * agent.size
-        portrayal["color"] = str(0.5**agent.size)
-    
-    if isinstance(agent, TrashCar):
-        portrayal["color"] = "1.0"
-        portrayal["zorder"] = 0
-
-    return portrayal
-
-
-def post_process(ax: Axes):
-    ax.set_aspect('equal')
-    ax.set_xticks([])
-    ax.set_yticks([])
-    ax.get_figure().set_size_inches(15,5)
+from Model import TrashCollection
+from Recorder import ReplayModel
+from Rendering import make_street_component
+from Charts import make_metrics_component
+from mesa.visualization import SolaraViz
 
 # Parameters of the model
 model_params = {
@@ -108,6 +59,15 @@ model_params = {
         "step": 1,
     },
 
+    "nr_of_robots": {
+        "type": "SliderInt",
+        "value": 1,
+        "label": "Number of robots",
+        "min": 1,
+        "max": 10,
+        "step": 1,
+    },
+
     "robot_max_speed_km_h": {
         "type": "SliderInt",
         "value": 7,
@@ -163,14 +123,61 @@ model_params = {
 trash_collection = TrashCollection()
 
 # Component of visualization that shows the space
-space_component = make_space_component(
-    trash_collection_portrayal, draw_grid=False, post_process=post_process
+# Agents are drawn with persistent artists, trash is aggregated into a density layer on very dirty streets
+space_component = make_street_component()
+
+# Live charts of the collected data. Charts are drawn from fixed-size min/max buffers, so their cost does not grow
+# with the number of steps run
+trash_chart = make_metrics_component(
+    {
+        "Amount of trash on street": "tab:blue",
+        # Amount of trash there would be on street without cleaning
+        "Total trash produced": "tab:grey",
+    },
+    ylabel="Units of trash",
+)
+disturbance_chart = make_metrics_component(
+    {"Robot Disturbance": "tab:red"},
+    # Disturbance of every robot is 0 when distant, 1 when close and 2 on contact, the chart shows the sum over the fleet
+    ylabel="Disturbance summed over robots (per robot: 0 - distant, 1 - close, 2 - contact)",
 )
 
+# Parameters of the replay of a recorded run
+replay_params = {
+    "recording_path": os.environ.get("TRASH_REPLAY"),
+
+    "start_time": {
+        "type": "SliderFloat",
+        "value": 0,
+        "label": "Start time (hours from start of the run)",
+        "min": 0,
+        "max": 72,
+        "step": 0.1,
+    },
+
+    "playback_speed": {
+        "type": "SliderInt",
+        "value": 1,
+        "label": "Playback speed (recorded frames per step)",
+        "min": 1,
+        "max": 100,
+        "step": 1,
+    },
+}
+
 # Instance of a visualization
-page = SolaraViz(
-    trash_collection,
-    components=[space_component],
-    model_params=model_params,
-    name="Trash Collection"
-)
+# If TRASH_REPLAY is set to the path of a recording, the recorded run is played back instead of simulated
+if replay_params["recording_path"] is None:
+    page = SolaraViz(
+        trash_collection,
+        components=[space_component, trash_chart, disturbance_chart],
+        model_params=model_params,
+        name="Trash Collection"
+    )
+else:
+    page = SolaraViz(
+        ReplayModel(replay_params["recording_path"]),
+        components=[space_component],
+        model_params=replay_params,
+        name="Trash Collection Replay"
+    )
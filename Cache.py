@@ -0,0 +1,186 @@
+import ast
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+import Model
+from Model import TrashCollection, STEPS_IN_HOUR
+from Agents import Robot, TrashCar
+
+# Directory of the cache and its maximum size in bytes
+DEFAULT_CACHE_DIR = "cache"
+DEFAULT_MAX_SIZE = 2 * 1024**3
+
+# Directory of the modules of the model
+MODEL_DIR = os.path.dirname(os.path.abspath(Model.__file__))
+
+# Arguments of TrashCollection that have side effects only and do not change results of a run
+IGNORED_PARAMS = {"save_logs", "record_path", "record_interval", "telemetry_sink", "publish_interval"}
+
+# Geometry backends that GoldenTrace.check_exact has shown to give bit-identical results, their runs share cache
+# entries. Runs of other backends are cached under their own keys
+EXACT_BACKENDS = {"python", "numpy"}
+
+
+# Source files of Model.py and of all modules of the project that it imports, directly or through other modules,
+# also inside functions. Their source defines the results of a run
+def model_sources():
+    sources = set()
+    pending = ["Model"]
+    while pending:
+        path = os.path.join(MODEL_DIR, pending.pop().replace(".", os.sep) + ".py")
+        if path in sources or not os.path.exists(path):
+            continue
+        sources.add(path)
+        with open(path) as file:
+            tree = ast.parse(file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module is not None:
+                pending.append(node.module)
+    return sorted(sources)
+
+
+# Hash of the source code of the model. Any change to it invalidates the cache
+def code_version() -> str:
+    digest = hashlib.sha256()
+    for path in model_sources():
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# Key of a run: hash of the arguments of the model, the seed and the source code of the model
+def run_key(model_params, seed) -> str:
+    params = {name: value for name, value in model_params.items() if name not in IGNORED_PARAMS}
+    if params.get("geometry_backend", "python") in EXACT_BACKENDS:
+        params.pop("geometry_backend", None)
+    description = json.dumps({"params": params, "seed": seed, "code": code_version()}, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+"""On-disk cache of the results of completed runs. Every result is stored in a file named by its key.
+    Reading a result marks it as recently used, and when the cache grows beyond its maximum size
+    the least recently used results are evicted.
+
+    Args:
+        directory: Directory of the cache
+        max_size: Maximum total size of the cached results in bytes
+"""
+class ResultCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                result = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Modification time of a result is its last use
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return result
+
+    def put(self, key, result):
+        # Write to a temporary file first, so that runs in parallel never read a partially written result
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.path(key))
+        self.evict()
+
+    # Remove least recently used results until the cache fits into its maximum size
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
+
+
+# Summary of a finished run
+def run_summary(model):
+    cleaners = list(model.agents_by_type.get(Robot, [])) + list(model.agents_by_type.get(TrashCar, []))
+    return {
+        "Steps": model.steps,
+        "Total trash produced": model.total_trash_produced,
+        "Trash cleaned": sum(cleaner.trash_cleaned for cleaner in cleaners),
+    }
+
+
+# Data collected over the whole run. A streamed run keeps only the rows since its last flush in memory, so its data
+# is read back from the stream file
+def collected_data(model):
+    if model.stream_path is None:
+        return model.datacollector.get_model_vars_dataframe()
+    model.flush_collected_data()
+    df = pd.read_csv(model.stream_path, index_col="Step")
+    df.index.name = None
+    return df
+
+
+"""Runs a full simulation with given arguments and seed, or loads its results from the cache if the same run was
+    completed before.
+
+    Args:
+        model_params: Arguments of TrashCollection except the seed
+        seed: Seed of the run, unseeded runs are never cached
+        cache: ResultCache to consult, no cache is used if None
+
+    Returns:
+        dict: "model_vars" - DataFrame of the collected data, "summary" - summary of the run
+"""
+def run_cached(model_params, seed, cache=None):
+    key = None
+    # Runs that record trajectories are always simulated, as the recording is their result. Unseeded runs are not
+    # reproducible, so they are never cached
+    if cache is not None and model_params.get("record_path") is None and seed is not None:
+        key = run_key(model_params, seed)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    model = TrashCollection(**{**model_params, "save_logs": False}, seed=seed)
+    for _ in range(round(model.full_simulation_time * STEPS_IN_HOUR)):
+        model.step()
+
+    result = {
+        "model_vars": collected_data(model),
+        "summary": run_summary(model),
+    }
+    if key is not None:
+        cache.put(key, result)
+    return result
@@ -0,0 +1,180 @@
+import numpy as np
+import solara
+from matplotlib.figure import Figure
+from mesa.visualization.utils import update_counter
+
+# Number of buckets kept per measure. Cost of drawing a chart does not depend on the number of steps run
+BUFFER_SIZE = 512
+
+"""Fixed-size buffer of a time series that preserves minimum and maximum of the series. Every bucket of the buffer
+    aggregates bucket_width consecutive values into their minimum, maximum and mean. When all the buckets are filled,
+    neighbouring buckets are merged pairwise and the width of a bucket is doubled, so the buffer always covers
+    the whole run with the same number of buckets.
+
+    Args:
+        size: Number of buckets in the buffer, must be even
+"""
+class MinMaxBuffer:
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size + size % 2
+        # Number of values aggregated in one full bucket
+        self.bucket_width = 1
+
+        # Step of the first value, minimum, maximum, sum and number of values in every bucket
+        self.start = np.zeros(self.size, dtype=np.int64)
+        self.min = np.zeros(self.size)
+        self.max = np.zeros(self.size)
+        self.sum = np.zeros(self.size)
+        self.count = np.zeros(self.size, dtype=np.int64)
+
+        # Index of the bucket that is currently being filled
+        self.index = 0
+
+    def __len__(self):
+        return self.index + (self.count[self.index] > 0 if self.index < self.size else 0)
+
+    def push(self, step, value):
+        if self.count[self.index] == self.bucket_width:
+            self.index += 1
+            if self.index == self.size:
+                self.compact()
+
+        i = self.index
+        if self.count[i] == 0:
+            self.start[i] = step
+            self.min[i] = value
+            self.max[i] = value
+        else:
+            self.min[i] = min(self.min[i], value)
+            self.max[i] = max(self.max[i], value)
+        self.sum[i] += value
+        self.count[i] += 1
+
+    # Merge neighbouring buckets pairwise, freeing the second half of the buffer
+    def compact(self):
+        half = self.size // 2
+        self.start[:half] = self.start[0::2]
+        self.min[:half] = np.minimum(self.min[0::2], self.min[1::2])
+        self.max[:half] = np.maximum(self.max[0::2], self.max[1::2])
+        self.sum[:half] = self.sum[0::2] + self.sum[1::2]
+        self.count[:half] = self.count[0::2] + self.count[1::2]
+
+        self.start[half:] = 0
+        self.min[half:] = 0
+        self.max[half:] = 0
+        self.sum[half:] = 0
+        self.count[half:] = 0
+
+        self.index = half
+        self.bucket_width *= 2
+
+    # Steps and values of the min/max envelope, two points per bucket
+    def envelope(self):
+        n = len(self)
+        steps = np.repeat(self.start[:n], 2)
+        values = np.column_stack([self.min[:n], self.max[:n]]).ravel()
+        return steps, values
+
+    # Steps and mean values of the buckets
+    def means(self):
+        n = len(self)
+        return self.start[:n], self.sum[:n] / np.maximum(self.count[:n], 1)
+
+
+"""Feeds MinMaxBuffers with reporter values of a model. Only rows collected since the previous update are read from
+    the data collector.
+
+    Args:
+        model: Mesa model with a data collector
+        measures: Names of model reporters to follow
+        size: Number of buckets in the buffer of each measure
+"""
+class MetricsTracker:
+    def __init__(self, model, measures, size=BUFFER_SIZE):
+        self.model = model
+        self.buffers = {measure: MinMaxBuffer(size) for measure in measures}
+        # Number of rows of the data collector already pushed to the buffers
+        self.rows_read = 0
+
+    def update(self):
+        model_vars = self.model.datacollector.model_vars
+        # Rows of a streamed run that were already written to the stream file are no longer in memory
+        rows_flushed = getattr(self.model, "rows_flushed", 0)
+        rows = rows_flushed + len(model_vars[next(iter(self.buffers))])
+        for measure, buffer in self.buffers.items():
+            values = model_vars[measure]
+            for row in range(max(self.rows_read, rows_flushed), rows):
+                buffer.push(row, values[row - rows_flushed])
+        self.rows_read = rows
+
+
+"""Chart of model reporters drawn from the downsampled buffers with persistent artists.
+
+    Args:
+        tracker: MetricsTracker with buffers of the measures
+        measures: Dictionary from measure name to line color
+        show_envelope: Whether to draw min/max envelope of a measure in addition to its mean
+        ylabel: Label of the y axis
+"""
+class MetricsChart:
+    def __init__(self, tracker, measures, show_envelope=True, ylabel=None):
+        self.tracker = tracker
+        self.show_envelope = show_envelope
+
+        self.figure = Figure(figsize=(7, 3))
+        self.ax = self.figure.add_subplot()
+        self.ax.set_xlabel("Step")
+        if ylabel is not None:
+            self.ax.set_ylabel(ylabel)
+
+        self.lines = {}
+        for measure, color in measures.items():
+            envelope_line = None
+            if show_envelope:
+                envelope_line, = self.ax.plot([], [], color=color, alpha=0.3, linewidth=1)
+            mean_line, = self.ax.plot([], [], color=color, label=measure)
+            self.lines[measure] = (envelope_line, mean_line)
+        self.ax.legend(loc="upper left")
+
+    def update(self):
+        self.tracker.update()
+        for measure, (envelope_line, mean_line) in self.lines.items():
+            buffer = self.tracker.buffers[measure]
+            if envelope_line is not None:
+                envelope_line.set_data(*buffer.envelope())
+            mean_line.set_data(*buffer.means())
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+
+def make_metrics_component(measures, show_envelope=True, ylabel=None, size=BUFFER_SIZE, page=0):
+    """Create a live chart component of model reporters backed by MinMaxBuffers.
+
+    Args:
+        measures: Dictionary from measure name to line color
+        show_envelope: Whether to draw min/max envelope of a measure in addition to its mean
+        ylabel: Label of the y axis
+        size: Number of buckets in the buffer of each measure
+        page: Page number where the chart should be displayed
+
+    Returns:
+        (function, page): A function that creates a MetricsPlot component for a model and a page number
+    """
+    def MakeMetricsPlot(model):
+        return MetricsPlot(model, measures, show_envelope, ylabel, size)
+
+    return MakeMetricsPlot, page
+
+
+@solara.component
+def MetricsPlot(model, measures, show_envelope, ylabel, size):
+    update_counter.get()
+
+    # Buffers and chart are created once per model and updated incrementally on the following frames
+    chart = solara.use_memo(
+        lambda: MetricsChart(MetricsTracker(model, measures, size), measures, show_envelope, ylabel),
+        dependencies=[model],
+    )
+    chart.update()
+
+    solara.FigureMatplotlib(chart.figure, format="png", dependencies=[chart, model.steps])
@@ -0,0 +1,117 @@
+import math
+
+from Agents import Human
+
+"""Spatial index of trash spots on a uniform grid with cells of the size of the merge radius. Spots within the merge
+    radius of a position can only lie in the cell of the position and its eight neighbouring cells, so a merge check
+    looks at a handful of spots regardless of the number of spots on the street.
+
+    Args:
+        merge_radius: Radius in meters within which trash spots are coalesced into one spot
+"""
+class TrashGrid:
+    def __init__(self, merge_radius):
+        self.merge_radius = merge_radius
+        # Trash spots by grid cell
+        self.cells = {}
+        # Cell of every trash spot in the grid
+        self.cell_of = {}
+
+    def cell(self, position):
+        return math.floor(position[0] / self.merge_radius), math.floor(position[1] / self.merge_radius)
+
+    def add(self, trash):
+        cell = self.cell(trash.position)
+        self.cells.setdefault(cell, set()).add(trash)
+        self.cell_of[trash] = cell
+
+    def remove(self, trash):
+        cell = self.cell_of.pop(trash, None)
+        if cell is None:
+            return
+        spots = self.cells[cell]
+        spots.discard(trash)
+        if not spots:
+            del self.cells[cell]
+
+    # Move trash spot to given position, keeping the grid up to date
+    def move(self, trash, x, y):
+        self.remove(trash)
+        trash.position[0] = x
+        trash.position[1] = y
+        self.add(trash)
+
+    # Nearest trash spot within the merge radius of given position, other than the excluded spot
+    def nearest(self, position, exclude=None):
+        i, j = self.cell(position)
+        nearest = None
+        nearest_distance = self.merge_radius
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for trash in self.cells.get((i + di, j + dj), ()):
+                    if trash is exclude:
+                        continue
+                    distance = math.dist(position, trash.position)
+                    if distance <= nearest_distance:
+                        nearest = trash
+                        nearest_distance = distance
+        return nearest
+
+
+"""Throws one unit of trash at given position into the nearest spot within the merge radius. The spot moves to
+    the size-weighted position of its trash and the new unit, and is coalesced with spots that got within the merge
+    radius by the move.
+
+    Args:
+        model: Model with a trash grid
+        position: Position where the trash is thrown
+
+    Returns:
+        bool: Whether the unit was added to an existing spot
+"""
+def litter_into_nearby_spot(model, position):
+    grid = model.trash_grid
+    trash = grid.nearest(position)
+    if trash is None:
+        return False
+
+    x, y = weighted_position(trash.position, trash.size, position, 1)
+    trash.increase()
+    grid.move(trash, x, y)
+    coalesce(model, trash)
+    return True
+
+
+# Merge all the spots within the merge radius into given spot, until no spot is left within the merge radius
+def coalesce(model, trash):
+    grid = model.trash_grid
+    other = grid.nearest(trash.position, exclude=trash)
+    while other is not None:
+        # Dwell time of both spots up to now is accounted at their current positions
+        for spot in (trash, other):
+            model.heatmaps.record_dwell(spot.position, spot.size, spot.last_change, model.steps)
+            spot.last_change = model.steps
+
+        x, y = weighted_position(trash.position, trash.size, other.position, other.size)
+        trash.size += other.size
+        other.size = 0
+
+        # Humans and the robot heading to the merged spot head to the coalesced spot instead, unless another robot
+        # claimed the coalesced spot
+        for human in model.agents_by_type.get(Human, []):
+            if human.nearest_trash is other:
+                human.nearest_trash = trash
+        robot = model.claims.release(other)
+        if robot is not None:
+            robot.set_target(trash)
+
+        other.remove()
+        grid.move(trash, x, y)
+        other = grid.nearest(trash.position, exclude=trash)
+
+
+def weighted_position(position, size, other_position, other_size):
+    total = size + other_size
+    return ((position[0] * size + other_position[0] * other_size) / total,
+            (position[1] * size + other_position[1] * other_size) / total)
+
@@ -0,0 +1,206 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+import pandas as pd
+from scipy import stats
+
+from Cache import ResultCache, run_cached, DEFAULT_CACHE_DIR
+
+
+# Mean amount of trash on the street over the run
+def mean_trash_on_street(df) -> float:
+    return float(df["Amount of trash on street"].mean())
+
+
+# Share of the ticks with robot present in which the robot was close to or in contact with a human
+def disturbance_share(df) -> float:
+    df_robot_present = df[df["Ticks with Robot present"] == 1]
+    if len(df_robot_present) == 0:
+        return 0.0
+    return float((df_robot_present["Robot Disturbance"] > 0).mean())
+
+
+# Metrics computed from the collected data of every run of an ensemble
+DEFAULT_METRICS = {
+    "Mean trash on street": mean_trash_on_street,
+    "Disturbance share": disturbance_share,
+}
+
+
+"""Runs one full simulation with given parameters and seed and returns the metrics of the run.
+
+    Args:
+        model_params: Arguments of TrashCollection except the seed
+        seed: Seed of the run
+        metrics: Dictionary from metric name to function computing the metric from the collected data
+        cache_dir: Directory of the result cache, the run is always simulated if None
+"""
+def run_replication(model_params, seed, metrics=DEFAULT_METRICS, cache_dir=DEFAULT_CACHE_DIR):
+    cache = ResultCache(cache_dir) if cache_dir is not None else None
+    df = run_cached(model_params, seed, cache)["model_vars"]
+
+    result = {"seed": seed}
+    for name, metric in metrics.items():
+        result[name] = metric(df)
+    return result
+
+
+"""Runs the same seed with treatment and baseline parameters. As both runs share the seed, they see the same
+    pedestrian and litter streams (common random numbers), and the difference of their metrics has much smaller
+    variance than the difference of independent runs.
+
+    Args:
+        model_params: Arguments of TrashCollection shared by both runs
+        treatment: Arguments of TrashCollection specific to the treatment run
+        baseline: Arguments of TrashCollection specific to the baseline run
+        seed: Seed of both runs
+        metrics: Dictionary from metric name to function computing the metric from the collected data
+        cache_dir: Directory of the result cache, the runs are always simulated if None
+"""
+def run_paired_replication(model_params, treatment, baseline, seed, metrics=DEFAULT_METRICS,
+                           cache_dir=DEFAULT_CACHE_DIR):
+    treatment_result = run_replication({**model_params, **treatment}, seed, metrics, cache_dir)
+    baseline_result = run_replication({**model_params, **baseline}, seed, metrics, cache_dir)
+
+    result = {"seed": seed}
+    for name in metrics:
+        result[f"{name} (treatment)"] = treatment_result[name]
+        result[f"{name} (baseline)"] = baseline_result[name]
+        result[name] = treatment_result[name] - baseline_result[name]
+    return result
+
+
+# Mean and half-width of the confidence interval of the mean of given values
+def confidence_interval(values, confidence=0.95):
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, math.inf
+    std = math.sqrt(sum((value - mean) ** 2 for value in values) / (n - 1))
+    half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * std / math.sqrt(n)
+    return mean, half_width
+
+
+"""Runs replications with consecutive seeds in parallel until the confidence intervals of all target metrics are
+    narrower than the tolerance, or until max_runs replications are finished. Replications still running when the
+    intervals become narrow enough are finished and included in the results.
+
+    Args:
+        replication: Function that is called with a seed and returns a dictionary of metric values
+        targets: Dictionary from target metric name to tolerance - maximum allowed half-width of its confidence interval
+        confidence: Confidence level of the intervals
+        min_runs: Minimum number of replications before the stopping rule is checked
+        max_runs: Maximum number of replications
+        n_workers: Number of worker processes, defaults to the number of CPUs
+        first_seed: Seed of the first replication
+
+    Returns:
+        (DataFrame, DataFrame): Metrics of every replication and summary with mean, half-width and number of runs
+        of every target metric
+"""
+def run_sequential(replication, targets, confidence=0.95, min_runs=5, max_runs=100, n_workers=None, first_seed=0):
+    results = []
+    next_seed = first_seed
+    n_workers = n_workers or os.cpu_count()
+
+    def converged():
+        if len(results) < min_runs:
+            return False
+        for name, tolerance in targets.items():
+            _, half_width = confidence_interval([result[name] for result in results], confidence)
+            if half_width > tolerance:
+                return False
+        return True
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = set()
+        while True:
+            # Keep all workers busy as long as more replications may be needed
+            while len(pending) < n_workers and next_seed < first_seed + max_runs:
+                pending.add(executor.submit(replication, next_seed))
+                next_seed += 1
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            results.extend(future.result() for future in done)
+
+            if converged():
+                # Replications that have not started are cancelled. The ones already running can not be stopped,
+                # so they are waited for and included in the results
+                running = [future for future in pending if not future.cancel()]
+                results.extend(future.result() for future in running)
+                break
+
+    df = pd.DataFrame(results).sort_values("seed").reset_index(drop=True)
+
+    summary = []
+    for name, tolerance in targets.items():
+        mean, half_width = confidence_interval(df[name].tolist(), confidence)
+        summary.append({"Metric": name, "Mean": mean, "Half-width": half_width, "Tolerance": tolerance,
+                        "Runs": len(df)})
+    return df, pd.DataFrame(summary).set_index("Metric")
+
+
+def run_ensemble(model_params, tolerances, metrics=DEFAULT_METRICS, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+    """Estimate metrics of one configuration to given precision.
+
+    Args:
+        model_params: Arguments of TrashCollection except the seed
+        tolerances: Dictionary from metric name to maximum allowed half-width of its confidence interval
+        metrics: Dictionary from metric name to function computing the metric from the collected data
+        cache_dir: Directory of the result cache, runs are always simulated if None
+        kwargs: Arguments of run_sequential
+
+    Returns:
+        (DataFrame, DataFrame): Metrics of every run and summary of the target metrics
+    """
+    replication = partial(run_replication, model_params, metrics=metrics, cache_dir=cache_dir)
+    return run_sequential(replication, tolerances, **kwargs)
+
+
+def compare_paired(model_params, treatment, baseline, tolerances, metrics=DEFAULT_METRICS,
+                   cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+    """Estimate the difference of metrics between treatment and baseline configuration to given precision using
+    common random numbers.
+
+    Args:
+        model_params: Arguments of TrashCollection shared by both configurations
+        treatment: Arguments of TrashCollection specific to the treatment, e.g. {"enable_robot": True}
+        baseline: Arguments of TrashCollection specific to the baseline, e.g. {"enable_robot": False}
+        tolerances: Dictionary from metric name to maximum allowed half-width of the interval of the difference
+        metrics: Dictionary from metric name to function computing the metric from the collected data
+        cache_dir: Directory of the result cache, runs are always simulated if None
+        kwargs: Arguments of run_sequential
+
+    Returns:
+        (DataFrame, DataFrame): Metrics and their differences for every seed and summary of the differences
+    """
+    replication = partial(run_paired_replication, model_params, treatment, baseline, metrics=metrics,
+                          cache_dir=cache_dir)
+    return run_sequential(replication, tolerances, **kwargs)
+
+
+if __name__ == "__main__":
+    # Compare the robot against the TrashCar baseline on the default street of the visualization
+    model_params = {
+        "street_length": 150,
+        "street_width": 15,
+        "nr_of_people": 20,
+        "human_speed_km_h": 5,
+        "littering_rate": 12,
+        "robot_max_speed_km_h": 7,
+        "robot_capacity": 50,
+        "robot_visibility": 10,
+        "off_screen_time": 30,
+        "full_simulation_time": 24,
+    }
+    runs, summary = compare_paired(
+        model_params,
+        treatment={"enable_robot": True},
+        baseline={"enable_robot": False},
+        tolerances={"Mean trash on street": 1, "Disturbance share": 0.01},
+    )
+    print(summary)
@@ -0,0 +1,321 @@
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+
+from Agents import littering_multiplier
+from Cache import ResultCache, run_cached, DEFAULT_CACHE_DIR
+from Model import STEPS_IN_MINUTE, STEPS_IN_HOUR, STEPS_IN_DAY
+
+# Parameters of the estimator fitted by calibrate() to 3 hour runs of CALIBRATION_POINTS with seeds 0 and 1. Mean
+# (max) absolute relative errors on the runs of VALIDATION_POINTS: mean trash on street 1.1% (1.5%), robot fill per
+# loop 4.3% (6.2%), charging duty cycle 0.5% (0.7%). The trash car mode is not calibrated
+DEFAULT_CALIBRATION = {
+    # Slowdown of the robot per person on the street
+    "crowd_slowdown": 0.0043,
+    # Area of the street in square meters per spot of trash once people litter on the spots they see
+    "spot_area": 22.4,
+    # Share of the spots in the band that the robot can turn to which it reaches in one crossing of a clean street
+    "coverage": 0.5,
+    # Largest number of spots per meter of the street that the robot reaches in one crossing
+    "spots_per_meter": 0.7,
+    # Share of the wishes to litter that end up as trash on the street
+    "litter_efficiency": 0.976,
+}
+
+CALIBRATED_NAMES = list(DEFAULT_CALIBRATION)
+
+# Multiplier of the littering rate in every minute of a day
+DAILY_MULTIPLIERS = np.array([littering_multiplier(minute * STEPS_IN_MINUTE)
+                              for minute in range(STEPS_IN_DAY // STEPS_IN_MINUTE)])
+
+# Rotation of the robot in degrees per step, as in Robot
+ROBOT_ROTATION = 2
+
+# Trash stays bounded if the cleaners remove this share of the trash thrown in a day after BOUNDED_HORIZON days
+KEEP_UP_SHARE = 0.95
+BOUNDED_HORIZON = 7
+
+# Arguments of TrashCollection that the calibration runs vary, on top of the estimator defaults. Points are within the
+# ranges of the dashboard sliders, and runs last a full day so that they cover the lunch and dinner peaks
+CALIBRATION_POINTS = [
+    {"littering_rate": 12, "street_length": 150, "street_width": 15, "nr_of_people": 20, "robot_capacity": 50,
+     "robot_max_speed_km_h": 7},
+    {"littering_rate": 50, "nr_of_people": 20, "robot_capacity": 50, "off_screen_time": 10},
+    {"littering_rate": 100, "nr_of_people": 10, "robot_capacity": 50, "off_screen_time": 120, "robot_max_speed_km_h": 4},
+    {"littering_rate": 100, "nr_of_people": 40, "robot_capacity": 20, "off_screen_time": 30, "street_width": 15},
+    {"littering_rate": 80, "nr_of_people": 30, "robot_capacity": 200, "off_screen_time": 15, "street_width": 20},
+    {"littering_rate": 30, "nr_of_people": 60, "robot_capacity": 100, "off_screen_time": 60, "street_length": 200,
+     "street_width": 20},
+]
+
+# Points that the estimator is validated on, none of them was used for calibration
+VALIDATION_POINTS = [
+    {"littering_rate": 100, "street_length": 150, "street_width": 15, "nr_of_people": 20},
+    {"littering_rate": 60, "nr_of_people": 30, "robot_capacity": 80, "off_screen_time": 45, "street_length": 250,
+     "street_width": 10},
+    {"littering_rate": 20, "nr_of_people": 80, "robot_capacity": 30, "off_screen_time": 20, "robot_max_speed_km_h": 6},
+]
+
+
+"""Fast mean-field estimate of a run of TrashCollection. Trash arrives with the expected littering rate of all people
+    and the same time-of-day profile as in the agent-based model. Every robot loop takes the time to cross the street
+    and the off-screen time, and removes the share of the trash it reaches until it is full. The trash car removes all
+    the trash at its sweeps. Estimates take milliseconds instead of the hours of a full run.
+
+    Args:
+        street_length, street_width, nr_of_people, littering_rate, robot_max_speed_km_h, robot_capacity,
+        robot_visibility, off_screen_time, full_simulation_time, enable_robot, nr_of_robots, robot_launch_interval:
+        Arguments of TrashCollection
+        calibration: Parameters of the estimator, DEFAULT_CALIBRATION if None
+        model_params: Other arguments of TrashCollection that the estimate does not depend on
+"""
+class TrashEstimator:
+    def __init__(
+            self,
+            street_length = 100,
+            street_width = 30,
+            nr_of_people = 20,
+            littering_rate = 10,
+            robot_max_speed_km_h = 10,
+            robot_capacity = 100,
+            robot_visibility = 10,
+            off_screen_time = 30,
+            full_simulation_time = 24,
+            enable_robot = True,
+            nr_of_robots = 1,
+            robot_launch_interval = 5,
+            calibration = None,
+            **model_params
+        ):
+        self.nr_of_people = nr_of_people
+        self.full_simulation_time = full_simulation_time
+        self.enable_robot = enable_robot
+        self.nr_of_robots = nr_of_robots
+        self.robot_capacity = robot_capacity
+        self.street_length = street_length
+        self.street_area = street_length * street_width
+        self.calibration = {**DEFAULT_CALIBRATION, **(calibration or {})}
+
+        # Humans and the robot move along the street including its off-screen parts
+        x_offset = street_length // 5
+        self.path_length = street_length + 2 * x_offset
+        # Speed in meters per step
+        self.robot_speed = robot_max_speed_km_h / 36
+        # Share of the width of the street in the band along its path in which the robot can turn to the spots it sees
+        turning_radius = self.robot_speed / math.radians(ROBOT_ROTATION)
+        half_band = min(robot_visibility, robot_visibility ** 2 / (2 * turning_radius))
+        self.band_share = min(1.0, 2 * half_band / street_width)
+        self.off_screen_steps = off_screen_time * STEPS_IN_MINUTE
+        self.launch_steps = robot_launch_interval * STEPS_IN_MINUTE
+        # Units of trash thrown by one person per step
+        self.littering_rate = littering_rate / STEPS_IN_DAY
+
+    # Expected number of units of trash thrown on the street by the end of every minute of the run
+    def cumulative_litter(self, n_minutes):
+        multipliers = np.resize(DAILY_MULTIPLIERS, n_minutes)
+        per_minute = (self.calibration["litter_efficiency"] * self.nr_of_people * self.littering_rate
+                      * STEPS_IN_MINUTE * multipliers)
+        return np.concatenate([[0.0], np.cumsum(per_minute)])
+
+    # Steps it takes a robot to cross the street
+    def crossing_steps(self):
+        slowdown = 1 + self.calibration["crowd_slowdown"] * self.nr_of_people
+        return slowdown * self.path_length / self.robot_speed
+
+    # Units of trash a robot collects in one crossing of a street with given amount of trash. The robot reaches fewer
+    # of the spots the more spots there are, as every spot takes a detour. It picks up whole spots until it is full,
+    # so it overfills by about one spot, and spots grow once the street is covered
+    def collected(self, on_street):
+        spot_size = max(1.0, on_street * self.calibration["spot_area"] / self.street_area)
+        spots = on_street / spot_size
+        reached = self.calibration["coverage"] * self.band_share * spots
+        reached /= 1 + reached / (self.calibration["spots_per_meter"] * self.street_length)
+        return min(reached * spot_size, self.robot_capacity - 1 + spot_size)
+
+    """Trash on the street and work of the cleaners over given number of steps.
+
+        Returns:
+            (Series, list, float): Expected amount of trash on the street at the end of every minute indexed by step,
+            amount of trash collected in every completed robot loop and number of steps robots spent off-screen
+    """
+    def simulate(self, n_steps):
+        n_minutes = -(-n_steps // STEPS_IN_MINUTE)
+        cumulative = self.cumulative_litter(n_minutes)
+        grid = np.arange(n_minutes + 1) * STEPS_IN_MINUTE
+
+        def litter_until(step):
+            return float(np.interp(step, grid, cumulative))
+
+        # Removals of trash from the street as (step, amount)
+        removals = []
+        fills = []
+        off_screen = 0.0
+        removed = 0.0
+
+        if self.enable_robot:
+            # Robots pass the trash in the middle of their crossing, events are processed in the order of time
+            events = [(i * self.launch_steps, i) for i in range(self.nr_of_robots)]
+            heapq.heapify(events)
+            while events:
+                start, robot = heapq.heappop(events)
+                if start >= n_steps:
+                    continue
+                crossing = self.crossing_steps()
+                on_street = max(litter_until(start + crossing / 2) - removed, 0.0)
+                collected = self.collected(on_street)
+                removed += collected
+                removals.append((start + crossing / 2, collected))
+
+                end = start + crossing
+                if end <= n_steps:
+                    fills.append(collected)
+                off_screen += max(0.0, min(end + self.off_screen_steps, n_steps) - min(end, n_steps))
+                heapq.heappush(events, (end + self.off_screen_steps, robot))
+        else:
+            # Trash car sweeps the whole street 6 hours after the start and then once a day
+            for sweep in range(6 * STEPS_IN_HOUR, n_steps + 1, STEPS_IN_DAY):
+                on_street = litter_until(sweep) - removed
+                removed += on_street
+                removals.append((sweep, on_street))
+
+        # Removals happen in the order of time
+        removal_steps = np.array([step for step, _ in removals])
+        removed_before = np.concatenate([[0.0], np.cumsum([amount for _, amount in removals])])
+        removed_by_step = removed_before[np.searchsorted(removal_steps, grid, side="right")]
+        trash = pd.Series(np.maximum(cumulative - removed_by_step, 0.0), index=grid, name="Amount of trash on street")
+        return trash, fills, off_screen
+
+    # Whether the cleaners keep up with the people in the long run: over the last day of BOUNDED_HORIZON days
+    # the trash on the street grows by only a small share of the trash thrown that day
+    def bounded(self):
+        n_steps = BOUNDED_HORIZON * STEPS_IN_DAY
+        trash, _, _ = self.simulate(n_steps)
+        growth = trash[n_steps] - trash[n_steps - STEPS_IN_DAY]
+        thrown = self.cumulative_litter(STEPS_IN_DAY // STEPS_IN_MINUTE)[-1]
+        return bool(growth <= (1 - KEEP_UP_SHARE) * thrown)
+
+    """Estimate the run.
+
+        Returns:
+            dict: "Amount of trash on street" - Series of the expected amount of trash at the end of every minute
+            indexed by step, "Mean trash on street", "Fill per loop" - mean amount of trash a robot collects in one
+            completed loop, "Duty cycle" - share of the time a robot spends off-screen charging, "Loops" - number of
+            completed loops of all robots, "Trash bounded" - whether the cleaners keep up with the people in the
+            long run
+    """
+    def estimate(self):
+        n_steps = round(self.full_simulation_time * STEPS_IN_HOUR)
+        trash, fills, off_screen = self.simulate(n_steps)
+        robot_steps = self.nr_of_robots * n_steps if self.enable_robot else 0
+        return {
+            "Amount of trash on street": trash,
+            "Mean trash on street": float(trash.mean()),
+            "Fill per loop": float(np.mean(fills)) if fills else 0.0,
+            "Duty cycle": off_screen / robot_steps if robot_steps > 0 else 0.0,
+            "Loops": len(fills),
+            "Trash bounded": self.bounded(),
+        }
+
+
+# Fill per completed loop and charging duty cycle of a single-robot run, measured from its collected data
+def measured_workload(df):
+    present = df["Ticks with Robot present"].to_numpy()
+    # A loop is completed when the robot leaves the street to charge
+    completions = np.flatnonzero((present[:-1] == 1) & (present[1:] == 0)) + 1
+    if len(completions) == 0:
+        fill = 0.0
+    else:
+        last = completions[-1]
+        cleaned = df["Total trash produced"].iloc[last] - df["Amount of trash on street"].iloc[last]
+        fill = float(cleaned / len(completions))
+    return {"Fill per loop": fill, "Duty cycle": float(1 - present.mean())}
+
+
+METRICS = ["Mean trash on street", "Fill per loop", "Duty cycle"]
+
+
+# Run the full model at every point with every seed, or load the runs from the cache, and measure the metrics
+def measure_points(points, model_params, seeds, hours, cache_dir):
+    cache = ResultCache(cache_dir) if cache_dir is not None else None
+    runs = []
+    for point in points:
+        params = {**(model_params or {}), **point, "full_simulation_time": hours}
+        for seed in seeds:
+            df = run_cached(params, seed, cache)["model_vars"]
+            measured = {"Mean trash on street": float(df["Amount of trash on street"].mean()), **measured_workload(df)}
+            runs.append((params, seed, measured))
+    return runs
+
+
+# Error of the estimate relative to the measured value, with a floor that keeps near-zero values from dominating
+def relative_error(estimate, measured):
+    return (estimate - measured) / max(abs(measured), 1e-2)
+
+
+# Measured and estimated metrics of every run with the relative error of the estimate
+def error_report(calibration, runs):
+    names = sorted(set().union(*(params for params, _, _ in runs)) - {"full_simulation_time"})
+    rows = []
+    for params, seed, measured in runs:
+        estimate = TrashEstimator(**params, calibration=calibration).estimate()
+        row = {**{name: params.get(name) for name in names}, "Seed": seed}
+        for metric in METRICS:
+            row[f"{metric} (model)"] = measured[metric]
+            row[f"{metric} (estimate)"] = estimate[metric]
+            row[f"{metric} (relative error)"] = relative_error(estimate[metric], measured[metric])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+"""Runs the full model at the calibration points and fits the parameters of the estimator to the runs.
+
+    Args:
+        points: Arguments of TrashCollection of every calibration point
+        model_params: Arguments of TrashCollection shared by all points
+        seeds: Seeds of the runs of every point
+        hours: Simulated time of a calibration run in hours
+        cache_dir: Directory of the result cache, the runs are always simulated if None
+
+    Returns:
+        (dict, DataFrame): Fitted calibration, and the measured and estimated metrics with the relative error of
+        every run
+"""
+def calibrate(points=CALIBRATION_POINTS, model_params=None, seeds=(0, 1), hours=24, cache_dir=DEFAULT_CACHE_DIR):
+    runs = measure_points(points, model_params, seeds, hours, cache_dir)
+
+    def residuals(values):
+        calibration = dict(zip(CALIBRATED_NAMES, values))
+        errors = []
+        for params, _, measured in runs:
+            estimate = TrashEstimator(**params, calibration=calibration).estimate()
+            errors.extend(relative_error(estimate[metric], measured[metric]) for metric in METRICS)
+        return errors
+
+    initial = [DEFAULT_CALIBRATION[name] for name in CALIBRATED_NAMES]
+    fit = least_squares(residuals, initial, bounds=([0, 1, 0.01, 0.01, 0.1], [1, 10000, 2, 100, 2]))
+    calibration = dict(zip(CALIBRATED_NAMES, fit.x.tolist()))
+    return calibration, error_report(calibration, runs)
+
+
+# Measured and estimated metrics of runs that the calibration was not fitted to
+def validate(calibration=None, points=VALIDATION_POINTS, model_params=None, seeds=(2,), hours=24,
+             cache_dir=DEFAULT_CACHE_DIR):
+    return error_report(calibration, measure_points(points, model_params, seeds, hours, cache_dir))
+
+
+def print_errors(report):
+    for metric in METRICS:
+        errors = report[f"{metric} (relative error)"].abs()
+        print(f"{metric}: mean absolute relative error {errors.mean():.1%}, max {errors.max():.1%}")
+
+
+if __name__ == "__main__":
+    calibration, report = calibrate()
+    print(calibration)
+    print("Calibration runs")
+    print_errors(report)
+    print("Validation runs")
+    print_errors(validate(calibration))
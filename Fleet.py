@@ -0,0 +1,37 @@
+"""Index of trash spots claimed by the robots of a fleet. Every trash spot is the target of at most one robot, so robots
+    spread over the spots in front of them instead of chasing the same spot. Robots leave spots claimed by other robots
+    out of their candidates before scoring, and every lookup is a dictionary lookup whose cost does not grow with
+    the size of the fleet. The index does not find candidates itself: every robot still finds the spots in front of it
+    with a radius query and scores all of them that are not claimed, so scoring is linear in the visible spots.
+"""
+class ClaimIndex:
+    def __init__(self):
+        # Robot that claimed the trash spot by trash spot
+        self.claimant = {}
+
+    def claimed_by_other(self, trash, robot):
+        claimant = self.claimant.get(trash)
+        return claimant is not None and claimant is not robot
+
+    # Claim trash spot for the robot, returns whether the spot is claimed by the robot
+    def claim(self, robot, trash):
+        if self.claimed_by_other(trash, robot):
+            return False
+        self.claimant[trash] = robot
+        return True
+
+    # Remove the claim of the robot on a trash spot, if the robot holds one
+    def unclaim(self, robot, trash):
+        if self.claimant.get(trash) is robot:
+            del self.claimant[trash]
+
+    # Release the claim of a trash spot. The robot that claimed the spot stops targeting it
+    def release(self, trash):
+        robot = self.claimant.pop(trash, None)
+        if robot is not None and robot.target_trash is trash:
+            robot.target_trash = None
+        return robot
+
+    # Trash spots that the robot may target
+    def unclaimed(self, robot, trash_spots):
+        return [trash for trash in trash_spots if not self.claimed_by_other(trash, robot)]
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from Agents import Human, Robot, Trash, TrashCar
+from Cache import code_version
+from Ensemble import confidence_interval
+from Model import TrashCollection, STEPS_IN_MINUTE
+
+# Directory of the recorded traces of the reference model. Traces are committed with the repository and recorded
+# again only on purpose, so that a change to the reference model shows up as a divergence
+GOLDEN_DIR = "golden"
+
+# Fixed seeded scenarios: arguments of the model, seed and number of steps
+SCENARIOS = {
+    "default": ({"street_length": 150, "street_width": 15, "nr_of_people": 20, "human_speed_km_h": 5,
+                 "littering_rate": 12, "robot_max_speed_km_h": 7, "robot_capacity": 50}, 42, 10*STEPS_IN_MINUTE),
+    "crowded": ({"street_length": 150, "street_width": 15, "nr_of_people": 200, "human_speed_km_h": 5,
+                 "littering_rate": 100, "robot_max_speed_km_h": 7, "robot_capacity": 50}, 7, 5*STEPS_IN_MINUTE),
+    "dirty": ({"street_length": 100, "street_width": 10, "nr_of_people": 50, "littering_rate": 5000,
+               "robot_capacity": 20, "off_screen_time": 1}, 3, 10*STEPS_IN_MINUTE),
+    "trash car": ({"street_length": 100, "street_width": 10, "nr_of_people": 50, "littering_rate": 5000,
+                   "enable_robot": False}, 5, 10*STEPS_IN_MINUTE),
+}
+
+REPORTERS = ["Amount of trash on street", "Total trash produced", "Robot Disturbance", "Ticks with Robot present"]
+
+
+# Attributes that make up the state of an agent of every type. The trash car is never placed on the street,
+# so its position is not part of its state
+AGENT_STATE = {
+    Human: ("x", "y", "direction", "wants_to_litter"),
+    Robot: ("x", "y", "direction", "close_to_human", "fullness", "time_to_charge", "trash_cleaned"),
+    TrashCar: ("time_until_first_sweep", "time_until_next_sweep", "trash_cleaned"),
+    Trash: ("x", "y", "size"),
+}
+
+
+# State of every agent of the model by agent type and id
+def agent_states(model):
+    states = {}
+    for agent_type, attributes in AGENT_STATE.items():
+        for agent in model.agents_by_type.get(agent_type, []):
+            state = []
+            for name in attributes:
+                if name == "x":
+                    state.append(float(agent.position[0]))
+                elif name == "y":
+                    state.append(float(agent.position[1]))
+                else:
+                    state.append(float(getattr(agent, name)))
+            states[(agent_type.__name__, agent.unique_id)] = tuple(state)
+    return states
+
+
+# 64-bit hash of the states of all agents of the model
+def state_hash(model):
+    digest = hashlib.blake2b(digest_size=8)
+    for key, state in sorted(agent_states(model).items()):
+        digest.update(repr(key).encode())
+        digest.update(np.asarray(state, dtype=np.float64).tobytes())
+    return int.from_bytes(digest.digest(), "little")
+
+
+"""Runs a scenario with given engine and records the trace of the run.
+
+    Args:
+        engine: Function that is called with the seed and the arguments of the model and returns a model
+        model_params: Arguments of the model
+        seed: Seed of the run
+        n_steps: Number of steps to run
+        hashes: Whether to record state hashes, requires an engine that exposes its agents
+
+    Returns:
+        (ndarray, ndarray, float): State hash of every step, reporter values of every step and time spent stepping
+        the model in seconds
+"""
+def run_trace(engine, model_params, seed, n_steps, hashes=True):
+    model = engine(seed=seed, **model_params, save_logs=False)
+    state_hashes = np.zeros(n_steps + 1, dtype=np.uint64)
+    if hashes:
+        state_hashes[0] = state_hash(model)
+
+    step_time = 0
+    for step in range(1, n_steps + 1):
+        start = time.perf_counter()
+        model.step()
+        step_time += time.perf_counter() - start
+        if hashes:
+            state_hashes[step] = state_hash(model)
+
+    # Engines that run in worker processes are shut down
+    if hasattr(model, "close"):
+        model.close()
+
+    df = model.datacollector.get_model_vars_dataframe()
+    return state_hashes, df[REPORTERS].to_numpy(dtype=float), step_time
+
+
+def trace_path(name):
+    return os.path.join(GOLDEN_DIR, f"{name.replace(' ', '_')}.npz")
+
+
+# Record traces of all scenarios with the reference model
+def record_golden_traces(scenarios=SCENARIOS):
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name, (model_params, seed, n_steps) in scenarios.items():
+        state_hashes, reporters, step_time = run_trace(TrashCollection, model_params, seed, n_steps)
+        np.savez_compressed(trace_path(name), hashes=state_hashes, reporters=reporters, step_time=step_time,
+                            params=json.dumps(model_params, sort_keys=True), seed=seed, n_steps=n_steps,
+                            code=code_version())
+
+
+def load_golden_trace(name):
+    path = trace_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Golden trace of scenario {name!r} is missing at {path}, "
+                                f"record it with the reference model: python GoldenTrace.py record")
+    return np.load(path)
+
+
+# Description of how a golden trace differs from its scenario, None if the trace was recorded for the scenario
+def stale_reason(golden, model_params, seed, n_steps):
+    if "n_steps" not in golden:
+        return "trace does not record its number of steps"
+    if json.loads(str(golden["params"])) != json.loads(json.dumps(model_params)):
+        return f"trace was recorded with arguments {str(golden['params'])}"
+    if int(golden["seed"]) != seed:
+        return f"trace was recorded with seed {int(golden['seed'])}"
+    if int(golden["n_steps"]) != n_steps:
+        return f"trace was recorded for {int(golden['n_steps'])} steps"
+    return None
+
+
+# Agents whose state differs between two models, with their states in both models
+def diverged_agents(reference, candidate):
+    reference_states = agent_states(reference)
+    candidate_states = agent_states(candidate)
+    diverged = []
+    for key in sorted(set(reference_states) | set(candidate_states)):
+        if reference_states.get(key) != candidate_states.get(key):
+            diverged.append((key, reference_states.get(key), candidate_states.get(key)))
+    return diverged
+
+
+# Run both engines to given step and return the agents whose states differ
+def find_diverged_agents(engine, model_params, seed, step):
+    reference = TrashCollection(seed=seed, **model_params, save_logs=False)
+    candidate = engine(seed=seed, **model_params, save_logs=False)
+    for _ in range(step):
+        reference.step()
+        candidate.step()
+    diverged = diverged_agents(reference, candidate)
+    if hasattr(candidate, "close"):
+        candidate.close()
+    return diverged
+
+
+"""Checks that an engine reproduces the golden traces of the reference model step by step.
+
+    Args:
+        engine: Function that is called with the seed and the arguments of the model and returns a model
+        scenarios: Scenarios to check
+
+    Returns:
+        list[dict]: For every scenario the first divergent step (None if the traces are equal), the reporter values
+        of both models at that step, the agents that diverged and the speedup of the engine. A scenario whose trace
+        was recorded for other arguments, seed or number of steps is not run and is reported as stale
+
+    Raises:
+        FileNotFoundError: If the golden trace of a scenario is missing
+"""
+def check_exact(engine, scenarios=SCENARIOS):
+    results = []
+    for name, (model_params, seed, n_steps) in scenarios.items():
+        golden = load_golden_trace(name)
+        reason = stale_reason(golden, model_params, seed, n_steps)
+        if reason is not None:
+            results.append({"Scenario": name, "Stale trace": f"{reason}, record it again: python GoldenTrace.py record"})
+            continue
+        state_hashes, reporters, step_time = run_trace(engine, model_params, seed, n_steps)
+
+        divergent = np.flatnonzero((state_hashes != golden["hashes"])
+                                   | np.any(reporters != golden["reporters"], axis=1))
+        result = {
+            "Scenario": name,
+            "First divergent step": None,
+            "Speedup": float(golden["step_time"]) / step_time,
+        }
+        if str(golden["code"]) != code_version():
+            result["Warning"] = "golden trace was recorded with a different version of the reference model"
+        if len(divergent) > 0:
+            step = int(divergent[0])
+            result["First divergent step"] = step
+            result["Reference reporters"] = dict(zip(REPORTERS, golden["reporters"][step]))
+            result["Engine reporters"] = dict(zip(REPORTERS, reporters[step]))
+            result["Diverged agents"] = find_diverged_agents(engine, model_params, seed, step)
+        results.append(result)
+    return results
+
+
+"""Checks that a stochastic engine is statistically equivalent to the reference model. Both models run the same
+    seeds, and the mean of every reporter over a run is compared seed by seed. The engine is equivalent if
+    the confidence interval of the mean difference lies within the tolerance relative to the reference mean.
+
+    Args:
+        engine: Function that is called with the seed and the arguments of the model and returns a model
+        scenarios: Scenarios to check
+        seeds: Seeds to run every scenario with
+        tolerance: Maximum allowed difference of reporter means relative to the reference mean
+        confidence: Confidence level of the intervals
+
+    Returns:
+        list[dict]: For every scenario and reporter the means, the interval of the difference, whether the engine
+        is equivalent, and the speedup of the engine
+"""
+def check_statistical(engine, scenarios=SCENARIOS, seeds=range(10), tolerance=0.05, confidence=0.95):
+    results = []
+    for name, (model_params, _, n_steps) in scenarios.items():
+        reference_means = []
+        engine_means = []
+        reference_time = 0
+        engine_time = 0
+        for seed in seeds:
+            _, reporters, step_time = run_trace(TrashCollection, model_params, seed, n_steps, hashes=False)
+            reference_means.append(reporters.mean(axis=0))
+            reference_time += step_time
+            _, reporters, step_time = run_trace(engine, model_params, seed, n_steps, hashes=False)
+            engine_means.append(reporters.mean(axis=0))
+            engine_time += step_time
+
+        reference_means = np.array(reference_means)
+        engine_means = np.array(engine_means)
+        for i, reporter in enumerate(REPORTERS):
+            difference, half_width = confidence_interval((engine_means[:, i] - reference_means[:, i]).tolist(),
+                                                         confidence)
+            reference_mean = reference_means[:, i].mean()
+            allowed = tolerance * abs(reference_mean)
+            results.append({
+                "Scenario": name,
+                "Reporter": reporter,
+                "Reference mean": reference_mean,
+                "Engine mean": engine_means[:, i].mean(),
+                "Difference": difference,
+                "Half-width": half_width,
+                "Equivalent": abs(difference) + half_width <= allowed,
+                "Speedup": reference_time / engine_time,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    # python GoldenTrace.py record - record golden traces of the reference model
+    # python GoldenTrace.py check - check the reference model against its golden traces
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record_golden_traces()
+    else:
+        for result in check_exact(TrashCollection):
+            print(result)
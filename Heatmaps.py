@@ -0,0 +1,68 @@
+import numpy as np
+
+"""Heatmaps of the street accumulated during the run. Every heatmap is a fixed-size grid over the street including
+    the parts off-screen where humans enter and leave, and every event updates a single cell.
+
+    Heatmaps:
+        litter: Number of trash units thrown in the cell
+        dwell: Trash dwell time, sum of trash size times number of steps the trash lied uncleaned in the cell
+        contact: Number of steps robot was in contact (closer than STOP_RADIUS) with a human in front of it
+        close: Number of steps robot was close (closer than SLOW_DOWN_RADIUS) to a human in front of it
+
+    Args:
+        x_min, x_max: Range of x coordinates covered by the heatmaps in meters
+        y_min, y_max: Range of y coordinates covered by the heatmaps in meters
+        cell_size: Size of one cell in meters
+"""
+class StreetHeatmaps:
+    NAMES = ("litter", "dwell", "contact", "close")
+
+    def __init__(self, x_min, x_max, y_min, y_max, cell_size=1):
+        self.x_min = x_min
+        self.y_min = y_min
+        self.cell_size = cell_size
+        self.nx = max(1, int(np.ceil((x_max - x_min) / cell_size)))
+        self.ny = max(1, int(np.ceil((y_max - y_min) / cell_size)))
+
+        # Grids are indexed [y cell, x cell] to be shown with imshow directly
+        self.grids = {name: np.zeros((self.ny, self.nx)) for name in self.NAMES}
+
+    # Indices of the cell containing given position, positions outside of the heatmap go to the nearest cell
+    def cell(self, position):
+        i = int((position[0] - self.x_min) // self.cell_size)
+        j = int((position[1] - self.y_min) // self.cell_size)
+        return min(max(j, 0), self.ny - 1), min(max(i, 0), self.nx - 1)
+
+    def add(self, name, position, amount=1):
+        self.grids[name][self.cell(position)] += amount
+
+    # One unit of trash was thrown at given position
+    def record_litter(self, position):
+        self.add("litter", position)
+
+    # Trash spot of given size lied at given position from step since to step until
+    def record_dwell(self, position, size, since, until):
+        if size > 0 and until > since:
+            self.add("dwell", position, size * (until - since))
+
+    # Robot at given position is close to a human: 1 - closer than SLOW_DOWN_RADIUS, 2 - closer than STOP_RADIUS
+    def record_disturbance(self, position, close_to_human):
+        if close_to_human == 2:
+            self.add("contact", position)
+        elif close_to_human == 1:
+            self.add("close", position)
+
+    # Add dwell time of the trash that is still on the street up to given step
+    def flush_dwell(self, trash_spots, step):
+        for trash in trash_spots:
+            self.record_dwell(trash.position, trash.size, trash.last_change, step)
+            trash.last_change = step
+
+    def export(self, path):
+        np.savez_compressed(
+            path,
+            x_min=self.x_min,
+            y_min=self.y_min,
+            cell_size=self.cell_size,
+            **self.grids,
+        )
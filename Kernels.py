@@ -0,0 +1,393 @@
+import math
+import warnings
+
+import numpy as np
+from mesa.experimental.continuous_space.continuous_space import ContinuousSpace
+
+from Agents import Human, Robot, Trash, OTHER_KIND, HUMAN_KIND, TRASH_KIND, ROBOT_KIND
+from Agents import CLEAR_BAND, SLOW_BAND, STOP_BAND
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Geometry backends that a model can be constructed with. "python" is the reference implementation in the agents
+BACKENDS = ("python", "numpy", "numba")
+
+
+# Kind of an agent kept next to its position in an IndexedSpace
+def kind_of(agent):
+    if isinstance(agent, Human):
+        return HUMAN_KIND
+    if isinstance(agent, Trash):
+        return TRASH_KIND
+    if isinstance(agent, Robot):
+        return ROBOT_KIND
+    return OTHER_KIND
+
+
+"""Continuous space that keeps the kind of every agent in an array parallel to the array of agent positions, so that
+    neighbours of one kind are filtered over arrays instead of isinstance checks over lists of agents.
+"""
+class IndexedSpace(ContinuousSpace):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._agent_kinds = np.zeros(self._agent_positions.shape[0], dtype=np.int8)
+        # Indices of the agents of every kind, rebuilt after an agent is added or removed
+        self._indices_by_kind = {}
+
+    @property
+    def agent_kinds(self):
+        return self._agent_kinds[:self._n_agents]
+
+    def _add_agent(self, agent):
+        index = super()._add_agent(agent)
+        if self._agent_kinds.shape[0] < self._agent_positions.shape[0]:
+            grown = np.zeros(self._agent_positions.shape[0], dtype=np.int8)
+            grown[:self._agent_kinds.shape[0]] = self._agent_kinds
+            self._agent_kinds = grown
+        self._agent_kinds[index] = kind_of(agent)
+        self._indices_by_kind.clear()
+        return index
+
+    def _remove_agent(self, agent):
+        index = self._agent_to_index[agent]
+        n_agents = self._n_agents
+        super()._remove_agent(agent)
+        # Kinds move one row up together with the positions
+        self._agent_kinds[index:n_agents - 1] = self._agent_kinds[index + 1:n_agents]
+        self._indices_by_kind.clear()
+
+    def shrink(self, capacity):
+        self._agent_kinds = self._agent_kinds[:capacity].copy()
+
+    # Indices of the agents of given kind in the order of the space
+    def indices_of(self, kind):
+        indices = self._indices_by_kind.get(kind)
+        if indices is None:
+            indices = self._indices_by_kind[kind] = np.flatnonzero(self.agent_kinds == kind)
+        return indices
+
+
+# Compile function with Numba, or return it unchanged if Numba is not installed
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+# Kernels below repeat the arithmetic of the agents operation by operation, so that they give bit-identical results.
+# The agents square distances with pow, which may differ from a multiplication in the last bit, while neighbours
+# within a radius are found with multiplications. Exponents of pow are passed as arguments, so that a compiler can not
+# replace pow by a multiplication. NumPy evaluates atan2 and pow with its own vectorized routines that may differ from
+# the math module, so those are always taken from the math module
+SQUARE = 2.0
+SQUARE_ROOT = 0.5
+
+
+def move_straight_kernel(x, y, direction, speed, height):
+    radian_direction = 2 * math.pi * (direction / 360)
+    x_disp = math.cos(radian_direction)
+    y_disp = math.sin(radian_direction)
+
+    x += x_disp * speed
+
+    new_y = y + y_disp * speed
+    if new_y < 0:
+        new_y = 0.0
+        direction = -direction
+    if new_y > height:
+        new_y = height
+        direction = -direction
+    return x, new_y, direction
+
+
+def distance_kernel(x, y, other_x, other_y, square):
+    return math.sqrt(math.pow(x - other_x, square) + math.pow(y - other_y, square))
+
+
+def angle_kernel(x, y, direction, position_x, position_y):
+    angle = 360 * math.atan2(position_y - y, position_x - x) / (2 * math.pi)
+
+    angle_diff = angle - direction
+    if abs(angle_diff + 360) < abs(angle_diff):
+        angle_diff += 360
+    if abs(angle_diff - 360) < abs(angle_diff):
+        angle_diff -= 360
+    return angle_diff
+
+
+"""Indices and distances of the agents of given kind within radius of a point, in the order of the space.
+    A distance is never smaller than its x component, so exact distances are computed only for the few agents
+    in the band of the radius around x.
+
+    Args:
+        positions: Positions of the agents in the space
+        kinds: Kinds of the agents in the space
+        kind: Kind of agents to find
+        x, y: Point to search around
+        radius: Radius of search
+        exclude: Index of an agent to leave out, usually the searching agent itself
+        x_sign: If 1, only agents with x coordinate smaller than x are found, if -1 only agents with x coordinate
+            larger than x, if 0 agents on both sides
+"""
+def within_numpy(positions, kinds, kind, x, y, radius, exclude, x_sign):
+    dx = positions[:, 0] - x
+    candidates = np.flatnonzero((np.abs(dx) <= radius) & (kinds == kind)).tolist()
+
+    indices = []
+    distances = []
+    for i in candidates:
+        if i == exclude:
+            continue
+        if x_sign != 0 and not x_sign * (x - positions[i, 0]) > 0:
+            continue
+        dx_i = dx[i]
+        dy_i = positions[i, 1] - y
+        distance = math.sqrt(dx_i * dx_i + dy_i * dy_i)
+        if distance <= radius:
+            indices.append(i)
+            distances.append(distance)
+    return indices, distances
+
+
+# Loop version of within_numpy for Numba
+def within_loop(positions, kinds, kind, x, y, radius, exclude, x_sign):
+    indices = np.empty(positions.shape[0], dtype=np.int64)
+    distances = np.empty(positions.shape[0])
+    n_found = 0
+    for i in range(positions.shape[0]):
+        if kinds[i] != kind or i == exclude:
+            continue
+        if x_sign != 0 and not x_sign * (x - positions[i, 0]) > 0:
+            continue
+        dx = positions[i, 0] - x
+        dy = positions[i, 1] - y
+        distance = math.sqrt(dx * dx + dy * dy)
+        if distance <= radius:
+            indices[n_found] = i
+            distances[n_found] = distance
+            n_found += 1
+    return indices[:n_found], distances[:n_found]
+
+
+"""Closest band that an agent in front of a robot is in, computed as in Robot.people_in_front, and the distance to
+    the nearest agent.
+
+    Args:
+        xs, ys: Positions of the agents
+        x, y: Position of the robot
+        direction: Direction of the robot
+        stop_radius, slow_radius: Radii of the stop and slow bands
+"""
+def front_band_numpy(xs, ys, x, y, direction, stop_radius, slow_radius):
+    dx = xs - x
+    dy = ys - y
+    distances = np.sqrt(dx * dx + dy * dy)
+
+    band = CLEAR_BAND
+    for i in np.flatnonzero(distances <= slow_radius).tolist():
+        if abs(angle_kernel(x, y, direction, float(xs[i]), float(ys[i]))) <= 90:
+            if distances[i] <= stop_radius:
+                band = STOP_BAND
+                break
+            band = SLOW_BAND
+    nearest = float(distances.min()) if distances.shape[0] > 0 else math.inf
+    return band, nearest
+
+
+# Loop version of front_band_numpy for Numba
+def front_band_loop(xs, ys, x, y, direction, stop_radius, slow_radius):
+    band = CLEAR_BAND
+    nearest = math.inf
+    for i in range(xs.shape[0]):
+        dx = xs[i] - x
+        dy = ys[i] - y
+        distance = math.sqrt(dx * dx + dy * dy)
+        nearest = min(nearest, distance)
+        if distance > slow_radius or band == STOP_BAND:
+            continue
+
+        angle_diff = 360 * math.atan2(ys[i] - y, xs[i] - x) / (2 * math.pi) - direction
+        if abs(angle_diff + 360) < abs(angle_diff):
+            angle_diff += 360
+        if abs(angle_diff - 360) < abs(angle_diff):
+            angle_diff -= 360
+        if abs(angle_diff) <= 90:
+            band = STOP_BAND if distance <= stop_radius else SLOW_BAND
+    return band, nearest
+
+
+"""Scores of trash spots for a robot, computed as in Algorithm.trash_score.
+
+    Args:
+        xs, ys: Positions of the trash spots
+        sizes: Sizes of the trash spots
+        robot_x, robot_y: Position of the robot
+        max_trash_size: Size of the biggest trash spot of the model
+        width: Length of the street
+        nr_of_people: Number of people on the street
+        max_speed, time_passed, expected_time, fullness, capacity: Attributes of the robot
+        square, square_root: Exponents of pow
+"""
+def trash_scores_numpy(xs, ys, sizes, robot_x, robot_y, max_trash_size, width, nr_of_people,
+                       max_speed, time_passed, expected_time, fullness, capacity, square, square_root):
+    x_disp = (xs - robot_x).tolist()
+    y_disp = (ys - robot_y).tolist()
+    atan2 = np.array([math.atan2(dy, dx) for dx, dy in zip(x_disp, y_disp)])
+    angle = np.abs(360 * (atan2 / 2*math.pi))
+    s_angle = 1 - angle / 180
+
+    if max_trash_size == 0:
+        s_amount = np.zeros(len(xs))
+    else:
+        s_amount = sizes / max_trash_size
+
+    dist_part_covered = xs / width
+
+    x_dist = (robot_x - xs).tolist()
+    y_dist = (robot_y - ys).tolist()
+    dist = np.array([math.pow(math.pow(dx, square) + math.pow(dy, square), square_root)
+                     for dx, dy in zip(x_dist, y_dist)])
+    time_to_trash = (1 + 0.05 * nr_of_people) * dist / max_speed
+    time_part_passed = (time_passed + time_to_trash) / expected_time
+    s_time = 1 - np.abs(dist_part_covered - time_part_passed)
+
+    capacity_part_filled = fullness + sizes / capacity
+    s_fullness = 1 - np.abs(dist_part_covered - capacity_part_filled)
+
+    return 1 * s_angle + 2 * s_amount + 1 * s_time + 1 * s_fullness
+
+
+# Loop version of trash_scores_numpy for Numba
+def trash_scores_loop(xs, ys, sizes, robot_x, robot_y, max_trash_size, width, nr_of_people,
+                      max_speed, time_passed, expected_time, fullness, capacity, square, square_root):
+    scores = np.empty(xs.shape[0])
+    for i in range(xs.shape[0]):
+        angle = abs(360 * (math.atan2(ys[i] - robot_y, xs[i] - robot_x) / 2*math.pi))
+        s_angle = 1 - angle / 180
+
+        s_amount = 0.0 if max_trash_size == 0 else sizes[i] / max_trash_size
+
+        dist_part_covered = xs[i] / width
+
+        x_dist = robot_x - xs[i]
+        y_dist = robot_y - ys[i]
+        dist = math.pow(math.pow(x_dist, square) + math.pow(y_dist, square), square_root)
+        time_to_trash = (1 + 0.05 * nr_of_people) * dist / max_speed
+        time_part_passed = (time_passed + time_to_trash) / expected_time
+        s_time = 1 - abs(dist_part_covered - time_part_passed)
+
+        capacity_part_filled = fullness + sizes[i] / capacity
+        s_fullness = 1 - abs(dist_part_covered - capacity_part_filled)
+
+        scores[i] = 1 * s_angle + 2 * s_amount + 1 * s_time + 1 * s_fullness
+    return scores
+
+
+"""Geometry kernels of the agents over the position and kind arrays of an IndexedSpace. Neighbour filtering and
+    scoring of trash spots work on arrays, movement and angles of single agents stay in the agents.
+
+    Args:
+        space: IndexedSpace of the model
+"""
+class NumpyKernels:
+    # Whether movement and angles of single agents are compiled, otherwise the agents compute them themselves
+    compiled = False
+
+    within_kernel = staticmethod(within_numpy)
+    front_band_kernel = staticmethod(front_band_numpy)
+    trash_scores_kernel = staticmethod(trash_scores_numpy)
+    move_straight_kernel = staticmethod(move_straight_kernel)
+    distance_kernel = staticmethod(distance_kernel)
+    angle_kernel = staticmethod(angle_kernel)
+
+    def __init__(self, space):
+        self.space = space
+
+    # Agents of given kind within radius of an agent, in the order of the space, with their distances
+    def within(self, agent, radius, kind, x_sign=0):
+        space = self.space
+        indices, distances = self.within_kernel(space.agent_positions, space.agent_kinds, kind,
+                                                float(agent.position[0]), float(agent.position[1]), radius,
+                                                space._agent_to_index[agent], x_sign)
+        return [space.active_agents[i] for i in indices], distances
+
+    # Nearest agent of given kind within radius of an agent by DirectionalAgent.distance_to, the first one in
+    # the order of the space on a tie
+    def nearest(self, agent, radius, kind, x_sign=0):
+        agents, _ = self.within(agent, radius, kind, x_sign)
+        if not agents:
+            return None
+        return min(agents, key=lambda other: self.distance(agent, other))
+
+    # Closest band that a human in front of the robot is in and the distance to the nearest human
+    def front_band(self, robot, stop_radius, slow_radius):
+        humans = self.space.agent_positions[self.space.indices_of(HUMAN_KIND)]
+        return self.front_band_kernel(humans[:, 0], humans[:, 1], float(robot.position[0]),
+                                      float(robot.position[1]), robot.direction, stop_radius, slow_radius)
+
+    def move_straight(self, agent, speed):
+        x, y, agent.direction = self.move_straight_kernel(float(agent.position[0]), float(agent.position[1]),
+                                                          agent.direction, speed, agent.space.height)
+        agent.position[0] = x
+        agent.position[1] = y
+
+    def distance(self, agent, other):
+        return self.distance_kernel(float(agent.position[0]), float(agent.position[1]),
+                                    float(other.position[0]), float(other.position[1]), SQUARE)
+
+    def angle_towards(self, agent, position):
+        return self.angle_kernel(float(agent.position[0]), float(agent.position[1]), agent.direction,
+                                 float(position[0]), float(position[1]))
+
+    # Trash spot with the highest score, the first one of the candidates on a tie
+    def choose_next_target(self, robot, trash_spots):
+        from Algorithm import maximum_trash_size
+        if not trash_spots:
+            return None
+
+        indices = [self.space._agent_to_index[trash] for trash in trash_spots]
+        positions = self.space.agent_positions[indices]
+        sizes = np.array([trash.size for trash in trash_spots])
+        scores = self.trash_scores_kernel(positions[:, 0], positions[:, 1], sizes,
+                                          float(robot.position[0]), float(robot.position[1]),
+                                          maximum_trash_size(robot.model), robot.space.width,
+                                          robot.model.nr_of_people, robot.max_speed, robot.time_passed,
+                                          robot.expected_time, robot.fullness, robot.capacity,
+                                          SQUARE, SQUARE_ROOT)
+        return trash_spots[int(np.argmax(scores))]
+
+
+# Geometry kernels compiled with Numba, including movement and angles of single agents
+class NumbaKernels(NumpyKernels):
+    compiled = True
+
+    within_kernel = staticmethod(jit(within_loop))
+    front_band_kernel = staticmethod(jit(front_band_loop))
+    trash_scores_kernel = staticmethod(jit(trash_scores_loop))
+    move_straight_kernel = staticmethod(jit(move_straight_kernel))
+    distance_kernel = staticmethod(jit(distance_kernel))
+    angle_kernel = staticmethod(jit(angle_kernel))
+
+
+"""Creates geometry kernels of given backend for a model.
+
+    Args:
+        backend: One of BACKENDS. "numba" falls back to "numpy" with a warning if Numba is not installed
+        space: IndexedSpace of the model
+
+    Returns:
+        NumpyKernels | None: Kernels of the backend, None for the reference "python" backend
+"""
+def make_kernels(backend, space):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown geometry backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "python":
+        return None
+    if backend == "numba":
+        if numba is not None:
+            return NumbaKernels(space)
+        warnings.warn("Numba is not installed, falling back to the NumPy geometry backend")
+    return NumpyKernels(space)
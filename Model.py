@@ -1,11 +1,20 @@
 from datetime import datetime
 import random
+import resource
+import sys
+
+import pandas as pd
 
 from mesa import Model
 from mesa.datacollection import DataCollector
-from mesa.experimental.continuous_space.continuous_space import ContinuousSpace
 
 from Agents import Human, Robot, Trash, TrashCar
+from Coalescing import TrashGrid
+from Fleet import ClaimIndex
+from Heatmaps import StreetHeatmaps
+from Kernels import IndexedSpace, make_kernels
+from Recorder import TrajectoryRecorder
+from Telemetry import TelemetryPublisher
 
 # Number of steps in second, minute, hour, day. One step is equivalent to decisecond = 1/10 second
 STEPS_IN_SECONDS = 10
@@ -13,6 +22,11 @@ STEPS_IN_MINUTE = 60*STEPS_IN_SECONDS
 STEPS_IN_HOUR = 60*STEPS_IN_MINUTE
 STEPS_IN_DAY = 24*STEPS_IN_HOUR
 
+# "Total trash produced" is reported as 0 in the last 10 seconds of every day
+TOTAL_TRASH_CUTOFF = STEPS_IN_DAY - 100
+# Number of collected rows written to the stream file at once
+STREAM_CHUNK = STEPS_IN_HOUR
+
 """Model that simulates a street with people passing along the street and throwing trash.
     A robot patrols the street and sweeps the trash.
     One step of the model is a decisecond (0.1 second) in real life.
@@ -24,6 +38,9 @@ STEPS_IN_DAY = 24*STEPS_IN_HOUR
         nr_of_people: Number of people on the street
         human_speed_km_h: Speed of humans in kilometers/hour
         littering_rate: Rate with which people litter on the street in trash units per hour
+        trash_merge_radius: Radius in meters within which trash spots are coalesced into one spot, spots are never
+            coalesced if None. Humans look for a spot within LITTER_SEEK_RADIUS before throwing trash on the ground,
+            so only a larger radius reduces the number of spots
         
         robot_max_energy: Maximum energy that robot can have
         robot_max_speed_km_h: Maximum speed of the robot in kilometers/hour
@@ -32,7 +49,25 @@ STEPS_IN_DAY = 24*STEPS_IN_HOUR
         off_screen_time: Time in minutes that robot is out of the simulation when it reaches the end of the street
         full_simulation_time: The time of simulation in hours after which it stops
         enable_robot: If robot should be enabled and collect trash or stay idle
+        nr_of_robots: Number of robots in the fleet that cleans the street
+        robot_launch_interval: Time in minutes between launches of two robots of the fleet at start
+        
+        record_path: Path of a file to record agent positions and trash events to, nothing is recorded if None
+        record_interval: Number of steps between two recorded frames
+        heatmap_cell_size: Size of a cell of the heatmaps of the street in meters
+        save_logs: If collected data and heatmaps should be saved to the logs folder at the end of the run
+        
+        stream_path: Path of a CSV file to which collected data is streamed during the run instead of being kept
+            in memory, required for week-long runs
+        compaction_interval: Number of steps between two compactions of the space and agent bookkeeping
+        telemetry_interval: Number of steps between two records of memory usage and agent counts
+        telemetry_sink: TelemetrySink to publish progress of the run to while it is running, nothing is published
+            and steps are not timed if None
+        publish_interval: Number of steps between two published telemetry messages
         
+        geometry_backend: Backend of geometry kernels of the agents: "python" for the reference implementation,
+            "numpy" for vectorized neighbour filtering and trash scoring, "numba" for kernels compiled with Numba
+            (falls back to "numpy" if Numba is not installed). All backends give identical results
         seed: Seed for random number generator
 """
 class TrashCollection(Model):
@@ -43,12 +78,25 @@ class TrashCollection(Model):
             nr_of_people = 20,
             human_speed_km_h = 10,
             littering_rate = 10,
+            trash_merge_radius = None,
             robot_max_speed_km_h = 10,
             robot_capacity = 100,
             robot_visibility = 10,
             off_screen_time = 30,
             full_simulation_time = 24,
             enable_robot = True,
+            nr_of_robots = 1,
+            robot_launch_interval = 5,
+            record_path = None,
+            record_interval = STEPS_IN_SECONDS,
+            heatmap_cell_size = 1,
+            save_logs = True,
+            stream_path = None,
+            compaction_interval = STEPS_IN_HOUR,
+            telemetry_interval = 10*STEPS_IN_MINUTE,
+            telemetry_sink = None,
+            publish_interval = 10*STEPS_IN_SECONDS,
+            geometry_backend = "python",
             seed = None
         ):
 
@@ -68,14 +116,31 @@ class TrashCollection(Model):
 
         # Number of hours that simulation runs in total
         self.full_simulation_time = full_simulation_time
+        self.save_logs = save_logs
 
         # Create a continuous space
         dimensions = [[0, street_length], [0, street_width]]
         rng = random.Random(seed)
-        self.space = ContinuousSpace(dimensions, torus=False, random=rng)
+        # Kernels and robots looking for people in front filter neighbours over the kinds of agents that an
+        # IndexedSpace keeps next to their positions
+        self.space = IndexedSpace(dimensions, torus=False, random=rng)
+        self.kernels = make_kernels(geometry_backend, self.space)
 
         self.count = 0
 
+        # Number of humans spawned so far, each of them gets its own random streams
+        self.humans_spawned = 0
+        # Seed of the streams of the humans. Unseeded runs draw it from the generator of the model, so that they
+        # do not all see the same pedestrians
+        self.stream_seed = self._seed if self._seed is not None else int(self.rng.integers(2**63))
+
+        # Heatmaps of litter, trash dwell time and robot disturbance, covering also the off-screen parts of the street
+        x_offset = street_length // 5
+        self.heatmaps = StreetHeatmaps(-x_offset, street_length + x_offset, 0, street_width, heatmap_cell_size)
+
+        # Spatial index of trash spots for coalescing spots within the merge radius
+        self.trash_grid = TrashGrid(trash_merge_radius) if trash_merge_radius is not None else None
+
         # Required for simulating current cleaning strategy
         self.total_trash_produced = 0
 
@@ -83,7 +148,7 @@ class TrashCollection(Model):
         model_reporters={
                 "Amount of trash on street": lambda m: sum(trash.size for trash in m.agents_by_type.get(Trash, [])),
                 # Does not accurately reflect total trash produced, perfectly reflects amount of trash there would be using trashcar
-                "Total trash produced": lambda m: m.total_trash_produced if m.steps < 863900 else 0,
+                "Total trash produced": lambda m: m.total_trash_produced if m.steps % STEPS_IN_DAY < TOTAL_TRASH_CUTOFF else 0,
                 "Robot Disturbance": lambda m: (
                     sum(robot.close_to_human for robot in m.agents_by_type.get(Robot, [])) if len(m.agents_by_type.get(Robot, [])) > 0 else 0
                 ),
@@ -94,19 +159,34 @@ class TrashCollection(Model):
 
         self.datacollector = DataCollector(model_reporters)
 
-        # Create robot if the robot is enabled
+        # Collected rows are periodically appended to the stream file and dropped from memory
+        self.stream_path = stream_path
+        self.rows_flushed = 0
+
+        # Memory usage and agent counts over time
+        self.compaction_interval = compaction_interval
+        self.telemetry_interval = telemetry_interval
+        self.telemetry = []
+        # Reporter values, speed of the run and time spent in phases of a step published while the run is going
+        self.publisher = TelemetryPublisher(telemetry_sink, publish_interval)
+
+        # Create robots if the robot is enabled
         self.enable_robot = enable_robot
 
+        # Trash spots claimed by the robots, every spot is the target of at most one robot
+        self.claims = ClaimIndex()
+
         if self.enable_robot:
             Robot.create_agents(
                 self,
-                1,
+                nr_of_robots,
                 space=self.space,
                 # Maximum speed of the robot is converted to meters per decisecond
                 max_speed=robot_max_speed_km_h / 36,
                 capacity=robot_capacity,
                 visibility=robot_visibility,
                 off_screen_steps=off_screen_time * STEPS_IN_MINUTE,
+                launch_delay=[i * robot_launch_interval * STEPS_IN_MINUTE for i in range(nr_of_robots)],
             )
         else:
             TrashCar.create_agents(
@@ -127,24 +207,129 @@ class TrashCollection(Model):
             littering_rate=littering_rate / STEPS_IN_DAY,
         )
 
+        # Recorder of agent positions and trash events for replaying the run
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = TrajectoryRecorder(record_path, self.space, interval=record_interval)
+
         # Make the model running
         self.running = True
         self.datacollector.collect(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        self.record_telemetry()
+
 
+    # Random streams for walking and littering of the next spawned human. Streams depend only on the seed and
+    # the number of the human, so runs with the same seed share the streams of every spawn. Humans that respawn
+    # in a different order, for example because they walk to trash that was cleaned differently, get different streams
+    def human_streams(self):
+        self.humans_spawned += 1
+        return (random.Random(f"{self.stream_seed}-walk-{self.humans_spawned}"),
+                random.Random(f"{self.stream_seed}-litter-{self.humans_spawned}"))
 
     def step(self):
-        # First activate all the people
-        self.agents_by_type[Human].shuffle_do("step")
-        if self.enable_robot:
-            # Then activate the robot
-            self.agents_by_type[Robot].do("step")
-        else:
-            self.agents_by_type[TrashCar].do("step")
+        with self.publisher.phase("Humans"):
+            # First activate all the people
+            self.agents_by_type[Human].shuffle_do("step")
+        with self.publisher.phase("Cleaner"):
+            if self.enable_robot:
+                # Then activate the robot
+                self.agents_by_type[Robot].do("step")
+            else:
+                self.agents_by_type[TrashCar].do("step")
 
-        # Collect data
-        self.datacollector.collect(self)
+        with self.publisher.phase("Data collection"):
+            # Collect data
+            self.datacollector.collect(self)
+            if self.recorder is not None:
+                self.recorder.record(self)
+        # Published before collected rows are flushed to the stream file
+        if self.publisher.due(self.steps):
+            self.publisher.publish(self, self.agent_counts(), STEPS_IN_SECONDS)
+
+        with self.publisher.phase("Housekeeping"):
+            if self.stream_path is not None and len(self.datacollector.model_vars["Amount of trash on street"]) >= STREAM_CHUNK:
+                self.flush_collected_data()
+            if self.steps % self.compaction_interval == 0:
+                self.compact()
+            if self.steps % self.telemetry_interval == 0:
+                self.record_telemetry()
 
         if self.steps == self.full_simulation_time * STEPS_IN_HOUR: # 864000 number of steps in 24 hours (1 day)
             self.running = False
-            df = self.datacollector.get_model_vars_dataframe()
-            df.to_csv(f"logs\\{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index_label="Step") # file name format: YYYY-MM-DD_HH-MM-SS
+            self.close()
+            if self.stream_path is not None:
+                self.flush_collected_data()
+            if self.save_logs:
+                timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # file name format: YYYY-MM-DD_HH-MM-SS
+                # Collected data of a streamed run is already in the stream file
+                if self.stream_path is None:
+                    df = self.datacollector.get_model_vars_dataframe()
+                    df.to_csv(f"logs\\{timestamp}.csv", index_label="Step")
+                self.get_telemetry_dataframe().to_csv(f"logs\\{timestamp}_telemetry.csv", index=False)
+                # Dwell time of trash that was not cleaned by the end of the run
+                self.heatmaps.flush_dwell(self.agents_by_type.get(Trash, []), self.steps)
+                self.heatmaps.export(f"logs\\{timestamp}_heatmaps.npz")
+
+    # Append collected rows to the stream file and drop them from memory
+    def flush_collected_data(self):
+        df = self.datacollector.get_model_vars_dataframe()
+        if len(df) == 0:
+            return
+        df.index = range(self.rows_flushed, self.rows_flushed + len(df))
+        df.to_csv(self.stream_path, mode="w" if self.rows_flushed == 0 else "a", header=self.rows_flushed == 0,
+                  index_label="Step")
+        self.rows_flushed += len(df)
+        for values in self.datacollector.model_vars.values():
+            values.clear()
+
+    # Humans constantly leave and respawn, and trash spots are created and cleaned. Dictionaries keep the memory of
+    # removed entries and the array of agent positions keeps its largest size, so they are rebuilt to fit
+    # the agents currently present
+    def compact(self):
+        space = self.space
+        space._agent_to_index = dict(space._agent_to_index)
+        space._index_to_agent = dict(space._index_to_agent)
+        capacity = max(1, round(1.2 * space._n_agents))
+        if space._agent_positions.shape[0] > 2 * capacity:
+            space._agent_positions = space._agent_positions[:capacity].copy()
+            space.agent_positions = space._agent_positions[:space._n_agents]
+            if isinstance(space, IndexedSpace):
+                space.shrink(capacity)
+        self._agents = dict(self._agents)
+
+    def record_telemetry(self):
+        record = {
+            "Step": self.steps,
+            "Memory (MB)": memory_usage_mb(),
+            "Space capacity": self.space._agent_positions.shape[0],
+        }
+        for agent_type, count in self.agent_counts().items():
+            record[f"{agent_type} agents"] = count
+        record["Collected rows in memory"] = len(self.datacollector.model_vars["Amount of trash on street"])
+        self.telemetry.append(record)
+
+    # Release the resources of a run: the trajectory recording and the telemetry sink
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        self.publisher.close()
+
+    def agent_counts(self):
+        return {agent_type.__name__: len(self.agents_by_type.get(agent_type, []))
+                for agent_type in (Human, Robot, TrashCar, Trash)}
+
+    def get_telemetry_dataframe(self):
+        return pd.DataFrame(self.telemetry)
+
+
+# Current memory usage of the process in megabytes, peak memory usage where the current one is unavailable
+def memory_usage_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024**2
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Peak memory is reported in bytes on macOS and in kilobytes elsewhere
+        return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
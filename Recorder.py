@@ -0,0 +1,305 @@
+import random
+
+import numpy as np
+from mesa import Model
+from mesa.experimental.continuous_space.continuous_space import ContinuousSpace
+
+from Agents import Human, Robot, Trash, STEPS_IN_HOUR
+
+MAGIC = b"TRSHREC1"
+
+# Agent types as stored in a recording
+HUMAN = 0
+ROBOT = 1
+TRASH = 2
+AGENT_TYPES = {Human: HUMAN, Robot: ROBOT, Trash: TRASH}
+
+# Size of a quantization step of coordinates in meters (1 cm)
+QUANTUM = 0.01
+# Number of frames between two keyframes. A seek decodes at most this many frames
+KEYFRAME_INTERVAL = 60
+
+KEYFRAME = 1
+DELTA_FRAME = 0
+
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("x_min", "<f8"), ("x_max", "<f8"), ("y_min", "<f8"), ("y_max", "<f8"),
+                         ("quantum", "<f8"), ("interval", "<u4"), ("keyframe_interval", "<u4")])
+FRAME_DTYPE = np.dtype([("kind", "u1"), ("step", "<u4"), ("n_removed", "<u4"), ("n_resized", "<u4"),
+                        ("n_moved", "<u4"), ("n_added", "<u4")])
+# Full record of an agent, used in keyframes and for agents that appeared or moved too far since the previous frame
+AGENT_DTYPE = np.dtype([("id", "<u4"), ("type", "u1"), ("size", "<u2"), ("x", "<i4"), ("y", "<i4")])
+REMOVED_DTYPE = np.dtype([("id", "<u4")])
+RESIZED_DTYPE = np.dtype([("id", "<u4"), ("size", "<u2")])
+MOVED_DTYPE = np.dtype([("id", "<u4"), ("dx", "<i2"), ("dy", "<i2")])
+INDEX_DTYPE = np.dtype([("step", "<u4"), ("offset", "<u8")])
+FOOTER_DTYPE = np.dtype([("index_offset", "<u8"), ("index_length", "<u8"), ("magic", "S8")])
+
+INT16_MAX = np.iinfo(np.int16).max
+
+"""Records positions of agents and trash events of a run into a compact binary file. Every interval steps a frame
+    is written. A frame is either a keyframe with the full state or a delta frame with removed agents (cleaned trash,
+    humans that left), resized trash spots, quantized displacements of moved agents and newly added agents.
+    Index of keyframes is written at the end of the file, so a recording can be seeked without decoding it whole.
+
+    Args:
+        path: Path of the recording file
+        space: Continuous space of the model
+        interval: Number of steps between two frames
+        keyframe_interval: Number of frames between two keyframes
+"""
+class TrajectoryRecorder:
+    def __init__(self, path, space, interval=10, keyframe_interval=KEYFRAME_INTERVAL):
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+
+        self.file = open(path, "wb")
+        header = np.array([(MAGIC, space.x_min, space.x_max, space.y_min, space.y_max, QUANTUM, interval,
+                            keyframe_interval)], dtype=HEADER_DTYPE)
+        self.file.write(header.tobytes())
+
+        # State of the agents in the previous frame sorted by id
+        self.previous = np.empty(0, dtype=AGENT_DTYPE)
+        self.frames_written = 0
+        self.index = []
+
+    # Record a frame of the model if a frame is due in the current step
+    def record(self, model):
+        if model.steps % self.interval != 0:
+            return
+
+        current = agent_records(model)
+        if self.frames_written % self.keyframe_interval == 0:
+            self.index.append((model.steps, self.file.tell()))
+            self.write_frame(KEYFRAME, model.steps, added=current)
+        else:
+            self.write_delta(model.steps, current)
+
+        self.previous = current
+        self.frames_written += 1
+
+    def write_delta(self, step, current):
+        previous = self.previous
+
+        # Agents present in both frames
+        common, i_prev, i_cur = np.intersect1d(previous["id"], current["id"], assume_unique=True,
+                                               return_indices=True)
+        removed = np.setdiff1d(previous["id"], common, assume_unique=True)
+        added_mask = np.ones(len(current), dtype=bool)
+        added_mask[i_cur] = False
+
+        before = previous[i_prev]
+        after = current[i_cur]
+
+        resized = after[before["size"] != after["size"]]
+
+        dx = after["x"].astype(np.int64) - before["x"]
+        dy = after["y"].astype(np.int64) - before["y"]
+        moved_mask = (dx != 0) | (dy != 0)
+        # Agents that moved further than a displacement can store are written as full records
+        too_far = (np.abs(dx) > INT16_MAX) | (np.abs(dy) > INT16_MAX)
+        added_mask[i_cur[too_far]] = True
+        moved_mask &= ~too_far
+
+        moved = np.empty(moved_mask.sum(), dtype=MOVED_DTYPE)
+        moved["id"] = after["id"][moved_mask]
+        moved["dx"] = dx[moved_mask]
+        moved["dy"] = dy[moved_mask]
+
+        self.write_frame(DELTA_FRAME, step, removed=removed.astype(REMOVED_DTYPE["id"]),
+                         resized=resized[["id", "size"]].astype(RESIZED_DTYPE), moved=moved,
+                         added=current[added_mask])
+
+    def write_frame(self, kind, step, removed=(), resized=(), moved=(), added=()):
+        frame = np.array([(kind, step, len(removed), len(resized), len(moved), len(added))], dtype=FRAME_DTYPE)
+        self.file.write(frame.tobytes())
+        for records in (removed, resized, moved, added):
+            if len(records) > 0:
+                self.file.write(np.ascontiguousarray(records).tobytes())
+
+    # Write the keyframe index and close the file
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.write(np.array([(index_offset, len(self.index), MAGIC)], dtype=FOOTER_DTYPE).tobytes())
+        self.file.close()
+
+
+# Full records of all recorded agents of the model sorted by id
+def agent_records(model):
+    agents = [agent for agent_type in AGENT_TYPES for agent in model.agents_by_type.get(agent_type, [])]
+    records = np.empty(len(agents), dtype=AGENT_DTYPE)
+    if len(agents) == 0:
+        return records
+
+    positions = np.array([agent.position for agent in agents], dtype=float)
+    records["id"] = [agent.unique_id for agent in agents]
+    records["type"] = [AGENT_TYPES[type(agent)] for agent in agents]
+    records["size"] = [agent.size if isinstance(agent, Trash) else 0 for agent in agents]
+    records["x"] = np.round(positions[:, 0] / QUANTUM)
+    records["y"] = np.round(positions[:, 1] / QUANTUM)
+    records.sort(order="id")
+    return records
+
+
+"""Reads a recording written by TrajectoryRecorder. The file is memory-mapped, so opening a recording and seeking
+    to any step only touches the keyframe index and the frames between the preceding keyframe and the step.
+
+    Args:
+        path: Path of the recording file
+"""
+class Recording:
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+        header = self.data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a trajectory recording")
+        self.x_min = float(header["x_min"])
+        self.x_max = float(header["x_max"])
+        self.y_min = float(header["y_min"])
+        self.y_max = float(header["y_max"])
+        self.quantum = float(header["quantum"])
+        self.interval = int(header["interval"])
+
+        self.frames_end = len(self.data)
+        self.index = self.read_index()
+        if len(self.index) == 0:
+            raise ValueError(f"{path} contains no frames")
+
+        self.first_step = int(self.index["step"][0])
+        self.last_step = None
+
+        # Currently decoded state: agent id -> [type, size, x, y]
+        self.state = {}
+        self.step = None
+        self.offset = None
+
+    def read_index(self):
+        footer_start = len(self.data) - FOOTER_DTYPE.itemsize
+        if footer_start >= HEADER_DTYPE.itemsize:
+            footer = self.data[footer_start:].view(FOOTER_DTYPE)[0]
+            if footer["magic"] == MAGIC:
+                index_offset = int(footer["index_offset"])
+                index_end = index_offset + int(footer["index_length"]) * INDEX_DTYPE.itemsize
+                self.frames_end = index_offset
+                return self.data[index_offset:index_end].view(INDEX_DTYPE)
+
+        # Recording of an unfinished run has no index, build it by scanning the frames
+        index = []
+        for offset, frame in self.frames(HEADER_DTYPE.itemsize):
+            if frame["kind"] == KEYFRAME:
+                index.append((frame["step"], offset))
+        return np.array(index, dtype=INDEX_DTYPE)
+
+    # Iterate over offsets and headers of the complete frames starting from given offset
+    def frames(self, offset):
+        while offset + FRAME_DTYPE.itemsize <= self.frames_end:
+            frame = self.data[offset:offset + FRAME_DTYPE.itemsize].view(FRAME_DTYPE)[0]
+            # Last frame of an unfinished run may be cut off
+            if offset + frame_length(frame) > self.frames_end:
+                return
+            yield offset, frame
+            offset += frame_length(frame)
+
+    # Decode one frame at given offset into the current state and return offset of the next frame
+    def apply_frame(self, offset):
+        frame = self.data[offset:offset + FRAME_DTYPE.itemsize].view(FRAME_DTYPE)[0]
+        position = offset + FRAME_DTYPE.itemsize
+
+        if frame["kind"] == KEYFRAME:
+            self.state = {}
+
+        removed, position = self.read_records(position, REMOVED_DTYPE, frame["n_removed"])
+        for agent_id in removed["id"].tolist():
+            self.state.pop(agent_id, None)
+
+        resized, position = self.read_records(position, RESIZED_DTYPE, frame["n_resized"])
+        for agent_id, size in resized.tolist():
+            self.state[agent_id][1] = size
+
+        moved, position = self.read_records(position, MOVED_DTYPE, frame["n_moved"])
+        for agent_id, dx, dy in moved.tolist():
+            record = self.state[agent_id]
+            record[2] += dx
+            record[3] += dy
+
+        added, position = self.read_records(position, AGENT_DTYPE, frame["n_added"])
+        for agent_id, agent_type, size, x, y in added.tolist():
+            self.state[agent_id] = [agent_type, size, x, y]
+
+        self.step = int(frame["step"])
+        return position
+
+    def read_records(self, position, dtype, count):
+        end = position + int(count) * dtype.itemsize
+        return self.data[position:end].view(dtype), end
+
+    # Decode the state of the last frame at or before given step
+    def seek(self, step):
+        step = max(step, self.first_step)
+
+        # Continue from the current state if no keyframe lies between it and the target step
+        keyframe = np.searchsorted(self.index["step"], step, side="right") - 1
+        if self.step is None or not self.index["step"][keyframe] <= self.step <= step:
+            self.offset = self.apply_frame(int(self.index["offset"][keyframe]))
+
+        for offset, frame in self.frames(self.offset):
+            if frame["step"] > step:
+                break
+            self.offset = self.apply_frame(offset)
+        else:
+            self.last_step = self.step
+
+        return self.step
+
+    # Positions of humans and robots, positions and sizes of trash spots in the current state in meters
+    def street_state(self):
+        if len(self.state) == 0:
+            empty = np.empty((0, 2))
+            return empty, empty, empty, np.empty(0)
+        records = np.array(list(self.state.values()), dtype=float)
+        types = records[:, 0]
+        positions = records[:, 2:] * self.quantum
+        trash = types == TRASH
+        return positions[types == HUMAN], positions[types == ROBOT], positions[trash], records[trash, 1]
+
+
+def frame_length(frame):
+    return (FRAME_DTYPE.itemsize
+            + int(frame["n_removed"]) * REMOVED_DTYPE.itemsize
+            + int(frame["n_resized"]) * RESIZED_DTYPE.itemsize
+            + int(frame["n_moved"]) * MOVED_DTYPE.itemsize
+            + int(frame["n_added"]) * AGENT_DTYPE.itemsize)
+
+
+"""Model that plays a recording back instead of simulating the street. Every step of the replay advances
+    the recording by playback_speed frames.
+
+    Args:
+        recording_path: Path of the recording file
+        start_time: Time in hours from the start of the run at which the replay starts
+        playback_speed: Number of recorded frames to advance per step of the replay
+"""
+class ReplayModel(Model):
+    def __init__(self, recording_path, start_time=0, playback_speed=1):
+        super().__init__()
+
+        self.recording = Recording(recording_path)
+        self.playback_speed = playback_speed
+
+        dimensions = [[self.recording.x_min, self.recording.x_max], [self.recording.y_min, self.recording.y_max]]
+        self.space = ContinuousSpace(dimensions, torus=False, random=random.Random())
+
+        # Step of the recorded run that is currently shown
+        self.recorded_step = self.recording.seek(int(start_time * STEPS_IN_HOUR))
+        self.running = True
+
+    def step(self):
+        self.recorded_step = self.recording.seek(self.recorded_step + self.playback_speed * self.recording.interval)
+        if self.recording.last_step == self.recorded_step:
+            self.running = False
+
+    def street_state(self):
+        return self.recording.street_state()
@@ -0,0 +1,142 @@
+import numpy as np
+import solara
+from matplotlib.figure import Figure
+from mesa.visualization.utils import update_counter
+
+from Agents import Robot, Human, Trash
+
+# Number of trash spots from which on trash spots are drawn as a density layer instead of separate markers
+DENSITY_THRESHOLD = 300
+# Size of one cell of the density layer in meters
+DENSITY_CELL_SIZE = 1
+
+# Marker sizes of the agents. Trash marker grows with the size of the spot, but not beyond the maximum size
+AGENT_MARKER_SIZE = 150
+TRASH_MARKER_SIZE = 150
+TRASH_MARKER_GROWTH = 30
+TRASH_MAX_MARKER_SIZE = 600
+
+"""Draws the street with persistent matplotlib artists. Instead of building a new figure with a portrayal for every
+    agent on every frame, one scatter artist is kept per agent type and only its offsets, sizes and colors are updated.
+    When the number of trash spots gets large, trash spots are aggregated into a density layer.
+
+    Args:
+        space: Continuous space of the model
+        density_threshold: Number of trash spots from which on trash is drawn as a density layer
+        density_cell_size: Size of one cell of the density layer in meters
+"""
+class StreetRenderer:
+    def __init__(self, space, density_threshold=DENSITY_THRESHOLD, density_cell_size=DENSITY_CELL_SIZE):
+        self.density_threshold = density_threshold
+
+        width = space.x_max - space.x_min
+        height = space.y_max - space.y_min
+
+        self.figure = Figure(figsize=(15, 5))
+        self.ax = self.figure.add_subplot()
+        self.ax.set_aspect('equal')
+        self.ax.set_xticks([])
+        self.ax.set_yticks([])
+        self.ax.set_xlim(space.x_min, space.x_max)
+        self.ax.set_ylim(space.y_min, space.y_max)
+
+        # Edges of the cells of the density layer
+        self.x_edges = np.linspace(space.x_min, space.x_max, max(1, round(width / density_cell_size)) + 1)
+        self.y_edges = np.linspace(space.y_min, space.y_max, max(1, round(height / density_cell_size)) + 1)
+
+        # Trash is a grey cross, getting darker and bigger with its size
+        self.trash_artist = self.ax.scatter([], [], marker="X", zorder=1)
+        # Each human is an orange circle
+        self.human_artist = self.ax.scatter([], [], s=AGENT_MARKER_SIZE, c="tab:orange", marker="o", zorder=2)
+        # Robot is a blue square
+        self.robot_artist = self.ax.scatter([], [], s=AGENT_MARKER_SIZE, c="tab:blue", marker="s", zorder=3)
+
+        # Density layer of trash, hidden while there are few trash spots
+        self.density_artist = self.ax.imshow(
+            np.zeros((len(self.y_edges) - 1, len(self.x_edges) - 1)),
+            extent=(space.x_min, space.x_max, space.y_min, space.y_max),
+            origin="lower",
+            cmap="Greys",
+            vmin=0,
+            vmax=1,
+            interpolation="nearest",
+            aspect="auto",
+            zorder=0,
+            visible=False,
+        )
+
+    # Update the artists to the current state of the model
+    def update(self, model):
+        self.draw(*street_state(model))
+
+    # Update the artists to given positions of humans, robots and trash spots and sizes of trash spots
+    def draw(self, human_positions, robot_positions, trash_positions, trash_sizes):
+        self.human_artist.set_offsets(human_positions)
+        self.robot_artist.set_offsets(robot_positions)
+
+        if len(trash_sizes) < self.density_threshold:
+            self.density_artist.set_visible(False)
+            self.trash_artist.set_visible(True)
+            self.trash_artist.set_offsets(trash_positions)
+            # As trash size increases its marker's size increases and its color gets darker
+            self.trash_artist.set_sizes(np.minimum(TRASH_MARKER_SIZE + TRASH_MARKER_GROWTH * trash_sizes,
+                                                   TRASH_MAX_MARKER_SIZE))
+            grey = 0.5 ** trash_sizes
+            self.trash_artist.set_facecolors(np.column_stack([grey, grey, grey, np.ones_like(grey)]))
+        else:
+            # Too many trash spots to draw separately - aggregate the amount of trash per cell
+            density, _, _ = np.histogram2d(trash_positions[:, 1], trash_positions[:, 0],
+                                           bins=[self.y_edges, self.x_edges], weights=trash_sizes)
+            self.density_artist.set_data(density)
+            self.density_artist.set_clim(0, max(1, density.max()))
+            self.density_artist.set_visible(True)
+            self.trash_artist.set_visible(False)
+
+
+# Positions of humans and robots, positions and sizes of trash spots of the model.
+# A model that is not simulated agent by agent (e.g. a replay) provides them by itself
+def street_state(model):
+    if hasattr(model, "street_state"):
+        return model.street_state()
+
+    trash_spots = model.agents_by_type.get(Trash, [])
+    trash_sizes = np.fromiter((trash.size for trash in trash_spots), dtype=float, count=len(trash_spots))
+    return (positions(model.agents_by_type.get(Human, [])), positions(model.agents_by_type.get(Robot, [])),
+            positions(trash_spots), trash_sizes)
+
+
+# Array of positions of given agents with one row per agent
+def positions(agents):
+    if len(agents) == 0:
+        return np.empty((0, 2))
+    return np.array([agent.position for agent in agents], dtype=float)
+
+
+def make_street_component(density_threshold=DENSITY_THRESHOLD, density_cell_size=DENSITY_CELL_SIZE):
+    """Create a space component that draws the street with a StreetRenderer.
+
+    Args:
+        density_threshold: Number of trash spots from which on trash is drawn as a density layer
+        density_cell_size: Size of one cell of the density layer in meters
+
+    Returns:
+        function: A function that creates a StreetSpace component for a model
+    """
+    def MakeStreetSpace(model):
+        return StreetSpace(model, density_threshold, density_cell_size)
+
+    return MakeStreetSpace
+
+
+@solara.component
+def StreetSpace(model, density_threshold, density_cell_size):
+    update_counter.get()
+
+    # Renderer is created once per model and reused for the following frames
+    renderer = solara.use_memo(
+        lambda: StreetRenderer(model.space, density_threshold, density_cell_size),
+        dependencies=[model, density_threshold, density_cell_size],
+    )
+    renderer.update(model)
+
+    solara.FigureMatplotlib(renderer.figure, format="png", dependencies=[renderer, model.steps])
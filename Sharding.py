@@ -0,0 +1,411 @@
+import bisect
+import math
+import multiprocessing
+import random
+from datetime import datetime
+
+import numpy as np
+from mesa import Model
+from mesa.agent import Agent
+from mesa.datacollection import DataCollector
+from mesa.experimental.continuous_space.continuous_space_agents import ContinuousSpaceAgent
+
+from Agents import Human, Robot, Trash, TrashCar, LITTER_SEEK_RADIUS, SLOW_DOWN_RADIUS
+from Heatmaps import StreetHeatmaps
+from Model import TrashCollection, STEPS_IN_SECONDS, STEPS_IN_HOUR, STEPS_IN_DAY, TOTAL_TRASH_CUTOFF
+from Telemetry import TelemetryPublisher
+
+# Agent classes that can migrate between shards. Trash migrates when a human litters just after crossing a boundary
+MIGRATING_CLASSES = {"Human": Human, "Robot": Robot, "Trash": Trash}
+
+
+# Copy of a human owned by a neighbouring shard, visible to neighbour queries but never stepped
+class GhostHuman(Human):
+    pass
+
+
+# Copy of a trash spot owned by a neighbouring shard. Changes made to it are sent to the owning shard as events
+class GhostTrash(Trash):
+    def increase(self):
+        self.size += 1
+        self.model.total_trash_produced += 1
+        self.model.heatmaps.record_litter(self.position)
+        self.model.outbox.append(("increase", self.gid, self.position[0], self.position[1], 1))
+
+    # Ghost trash is removed when it is swept by the robot
+    def remove(self):
+        self.model.outbox.append(("remove", self.gid, self.position[0], self.position[1], self.size))
+        self.discard()
+
+    # Remove the copy without notifying the owning shard
+    def discard(self):
+        self.model.claims.release(self)
+        ContinuousSpaceAgent.remove(self)
+
+
+# Reference to an agent by its global id, used when an agent referring to other agents migrates between shards
+class AgentReference:
+    def __init__(self, gid):
+        self.gid = gid
+
+
+# Create an agent of given class in the shard from its state without calling its constructor
+def restore_agent(shard, agent_class, state, x, y):
+    agent = agent_class.__new__(agent_class)
+    ContinuousSpaceAgent.__init__(agent, shard.space, shard)
+    agent.__dict__.update(state)
+    agent.position[0] = x
+    agent.position[1] = y
+    # Humans of other shards were not seen by the robots of this shard, and a robot from another shard has not seen
+    # the humans of this shard, so they check for people in front again
+    if isinstance(agent, Human):
+        agent.appear()
+    if isinstance(agent, Robot):
+        agent.clear_steps = 0
+    return agent
+
+
+# State of an agent that can be sent to another shard. References to other agents are replaced by their global ids
+def agent_state(agent):
+    state = {}
+    for name, value in agent.__dict__.items():
+        if name in ("model", "unique_id"):
+            continue
+        if isinstance(value, Agent):
+            value = AgentReference(value.gid)
+        state[name] = value
+    return state
+
+
+"""One segment of a sharded street. The shard is a TrashCollection whose space still spans the whole street, but
+    it owns and steps only the agents with x coordinate in [x_min, x_max). Agents of neighbouring shards within
+    halo_width of the segment are present as ghosts, so neighbour queries near the boundary see them.
+
+    Every shard builds the same initial population from the seed and keeps only its own part of it.
+
+    Args:
+        model_params: Arguments of TrashCollection
+        seed: Seed of the run
+        shard_index: Index of the shard from the west end of the street
+        boundaries: x coordinates of the boundaries between shards
+        halo_width: Width in meters of the halo regions on both sides of the segment
+"""
+class TrashShard(TrashCollection):
+    def __init__(self, model_params, seed, shard_index, boundaries, halo_width):
+        self.shard_index = shard_index
+        self.boundaries = [float(boundary) for boundary in boundaries]
+        bounds = [-math.inf] + self.boundaries + [math.inf]
+        self.x_min = bounds[shard_index]
+        self.x_max = bounds[shard_index + 1]
+        self.halo_width = halo_width
+
+        # Changes made to ghost trash in the current step, sent to the owning shards
+        self.outbox = []
+        # Ghost agents by global id
+        self.ghosts = {}
+
+        super().__init__(**model_params, save_logs=False, seed=seed)
+
+        # Keep only the agents of this segment from the initial population
+        for agent in list(self.agents_by_type.get(Human, [])) + list(self.agents_by_type.get(Robot, [])):
+            if self.owner(agent.position[0]) != shard_index:
+                agent.remove()
+        self.sharded = True
+
+    # Humans spawned by a shard get streams distinct from the streams of other shards
+    def human_streams(self):
+        if not getattr(self, "sharded", False):
+            return super().human_streams()
+        self.humans_spawned += 1
+        return (random.Random(f"{self.stream_seed}-shard{self.shard_index}-walk-{self.humans_spawned}"),
+                random.Random(f"{self.stream_seed}-shard{self.shard_index}-litter-{self.humans_spawned}"))
+
+    # Every agent gets a global id unique across all shards
+    def register_agent(self, agent):
+        super().register_agent(agent)
+        if "gid" not in agent.__dict__:
+            agent.gid = (self.shard_index, agent.unique_id)
+
+    def owner(self, x):
+        return bisect.bisect_right(self.boundaries, x)
+
+    def step(self):
+        # First activate all the people of the shard, then the robot if it is in the shard
+        self.agents_by_type[Human].shuffle_do("step")
+        if self.enable_robot:
+            self.agents_by_type[Robot].do("step")
+        else:
+            self.agents_by_type[TrashCar].do("step")
+
+    # Apply migrating agents, ghosts and events sent by other shards
+    def apply(self, immigrants, ghosts, events):
+        arrived = []
+        for class_name, state, x, y in immigrants:
+            arrived.append(restore_agent(self, MIGRATING_CLASSES[class_name], state, x, y))
+
+        owned_trash = {trash.gid: trash for trash in self.agents_by_type.get(Trash, [])}
+        for operation, gid, x, y, amount in events:
+            self.apply_event(owned_trash, operation, gid, x, y, amount)
+
+        self.update_ghosts(ghosts, owned_trash)
+
+        # Resolve references of arrived agents to local trash or its ghosts
+        for agent in arrived:
+            for name, value in agent.__dict__.items():
+                if isinstance(value, AgentReference):
+                    setattr(agent, name, owned_trash.get(value.gid, self.ghosts.get(value.gid)))
+            # Claims of a robot are kept by the shard that owns the robot
+            if isinstance(agent, Robot):
+                agent.set_target(agent.target_trash)
+
+    def apply_event(self, owned_trash, operation, gid, x, y, amount):
+        trash = owned_trash.get(gid)
+        if operation == "increase":
+            if trash is None:
+                # Trash was cleaned in this shard while a human of another shard was littering into it
+                trash = restore_agent(self, Trash, {"size": 0, "last_change": self.steps}, x, y)
+                owned_trash[gid] = trash
+            self.heatmaps.record_dwell(trash.position, trash.size, trash.last_change, self.steps)
+            trash.last_change = self.steps
+            trash.size += amount
+        elif operation == "remove" and trash is not None:
+            self.heatmaps.record_dwell(trash.position, trash.size, trash.last_change, self.steps)
+            trash.last_change = self.steps
+            # Units thrown into the spot in this shard since the robot saw it stay on the street
+            trash.size -= amount
+            if trash.size <= 0:
+                trash.size = 0
+                self.forget_trash(trash)
+                trash.remove()
+                del owned_trash[gid]
+
+    # Reset references of owned agents to a trash spot that is removed from the shard, or point them to
+    # the replacement of the spot if the spot has migrated into the shard
+    def forget_trash(self, trash, replacement=None):
+        for human in self.agents_by_type.get(Human, []):
+            if human.nearest_trash is trash:
+                human.nearest_trash = replacement
+        robot = self.claims.release(trash)
+        if robot is not None:
+            robot.set_target(replacement)
+
+    def update_ghosts(self, ghosts, owned_trash):
+        current = {}
+        for kind, gid, x, y, size in ghosts:
+            ghost = self.ghosts.get(gid)
+            if ghost is None:
+                if kind == "Human":
+                    ghost = restore_agent(self, GhostHuman, {"gid": gid}, x, y)
+                else:
+                    ghost = restore_agent(self, GhostTrash, {"gid": gid, "size": size, "last_change": self.steps}, x, y)
+            else:
+                ghost.position[0] = x
+                ghost.position[1] = y
+                if kind == "Trash":
+                    ghost.size = size
+            current[gid] = ghost
+
+        for gid, ghost in self.ghosts.items():
+            if gid not in current:
+                if isinstance(ghost, GhostTrash):
+                    self.forget_trash(ghost, owned_trash.get(gid))
+                    ghost.discard()
+                else:
+                    ContinuousSpaceAgent.remove(ghost)
+        self.ghosts = current
+
+    # Agents leaving the segment, ghosts for the neighbouring shards, ghost events and partial reporter values
+    def outputs(self):
+        emigrants = []
+        for agent in [agent for agent_class in MIGRATING_CLASSES.values()
+                      for agent in self.agents_by_type.get(agent_class, [])]:
+            x, y = agent.position
+            if not self.x_min <= x < self.x_max:
+                emigrants.append((self.owner(x), (type(agent).__name__, agent_state(agent), x, y)))
+                agent.remove()
+
+        # Owned agents within the halo of the west and east boundary
+        west_ghosts = []
+        east_ghosts = []
+        for agent_type in (Human, Trash):
+            for agent in self.agents_by_type.get(agent_type, []):
+                x, y = agent.position
+                ghost = (agent_type.__name__, agent.gid, x, y, getattr(agent, "size", 0))
+                if x < self.x_min + self.halo_width:
+                    west_ghosts.append(ghost)
+                if x >= self.x_max - self.halo_width:
+                    east_ghosts.append(ghost)
+
+        events = self.outbox
+        self.outbox = []
+
+        robots = self.agents_by_type.get(Robot, [])
+        reporters = {
+            "trash_on_street": sum(trash.size for trash in self.agents_by_type.get(Trash, [])),
+            "total_trash_produced": self.total_trash_produced,
+            "robot_disturbance": sum(robot.close_to_human for robot in robots),
+            "robot_present": any(robot.present for robot in robots),
+            # Owned agents only, ghosts are counted by the shards that own them
+            "agent_counts": self.agent_counts(),
+        }
+        return emigrants, west_ghosts, east_ghosts, events, reporters
+
+    # Heatmaps of the shard including dwell time of the trash still on the street
+    def final_heatmaps(self):
+        self.heatmaps.flush_dwell(self.agents_by_type.get(Trash, []), self.steps)
+        return self.heatmaps.grids
+
+
+# Process running one shard. Every message from the coordinator is applied and followed by one step of the shard
+def shard_worker(connection, model_params, seed, shard_index, boundaries, halo_width):
+    shard = TrashShard(model_params, seed, shard_index, boundaries, halo_width)
+    connection.send(shard.outputs())
+    while True:
+        message = connection.recv()
+        if message is None:
+            connection.send(shard.final_heatmaps())
+            break
+        shard.apply(*message)
+        shard.step()
+        connection.send(shard.outputs())
+    connection.close()
+
+
+"""Simulation of a long street split into x segments, each simulated by a TrashShard in its own process.
+    Humans and the robot migrate between shards when they cross a boundary, neighbour queries near a boundary use
+    ghosts in halo regions, and per-step results of the shards are merged into the same DataCollector output
+    as of TrashCollection.
+
+    Results are statistically, not step by step, equivalent to TrashCollection: shards step their humans in parallel
+    and ghosts lag one step behind their owners.
+
+    Args:
+        n_shards: Number of shards and processes
+        seed: Seed for random number generator
+        model_params: Arguments of TrashCollection. Recording of trajectories and coalescing of trash spots are not
+            supported in sharded mode
+"""
+class ShardedTrashCollection(Model):
+    def __init__(self, n_shards=2, seed=None, **model_params):
+        super().__init__(seed=seed)
+
+        model_params.pop("record_path", None)
+        # Coalescing would merge spots with ghosts of other shards
+        model_params.pop("trash_merge_radius", None)
+        self.save_logs = model_params.pop("save_logs", True)
+        # Telemetry is published by the coordinator, with agent counts summed over the shards
+        self.publisher = TelemetryPublisher(model_params.pop("telemetry_sink", None),
+                                            model_params.pop("publish_interval", 10*STEPS_IN_SECONDS))
+
+        # Unsharded model with the same arguments resolves the seed and dimensions of the street
+        probe = TrashCollection(**model_params, save_logs=False, seed=seed)
+        self.full_simulation_time = probe.full_simulation_time
+        street_length = probe.width
+        street_width = probe.height
+        robot_visibility = model_params.get("robot_visibility", 10)
+        heatmap_cell_size = model_params.get("heatmap_cell_size", 1)
+
+        # Shards split the street including the off-screen parts where humans enter and leave
+        x_offset = street_length // 5
+        self.boundaries = np.linspace(-x_offset, street_length + x_offset, n_shards + 1)[1:-1].tolist()
+        # Halo covers every radius in which agents look for other agents
+        halo_width = max(SLOW_DOWN_RADIUS, LITTER_SEEK_RADIUS, robot_visibility)
+
+        self.heatmaps = StreetHeatmaps(-x_offset, street_length + x_offset, 0, street_width, heatmap_cell_size)
+
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for shard_index in range(n_shards):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=shard_worker,
+                args=(child_connection, model_params, probe.stream_seed, shard_index, self.boundaries, halo_width),
+                daemon=True,
+            )
+            process.start()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+        # Merged values of the shards
+        self.trash_on_street = 0
+        self.total_trash_produced = 0
+        self.robot_disturbance = 0
+        self.robot_present = False
+        self.agent_count_totals = {}
+
+        model_reporters = {
+            "Amount of trash on street": lambda m: m.trash_on_street,
+            "Total trash produced": lambda m: m.total_trash_produced if m.steps % STEPS_IN_DAY < TOTAL_TRASH_CUTOFF else 0,
+            "Robot Disturbance": lambda m: m.robot_disturbance,
+            "Ticks with Robot present": lambda m: 1 if m.robot_present else 0,
+        }
+        self.datacollector = DataCollector(model_reporters)
+
+        self.messages = self.merge([connection.recv() for connection in self.connections])
+
+        self.running = True
+        self.datacollector.collect(self)
+
+    # Route outputs of the shards to their destinations and merge their reporter values
+    def merge(self, outputs):
+        n_shards = len(outputs)
+        immigrants = [[] for _ in range(n_shards)]
+        ghosts = [[] for _ in range(n_shards)]
+        events = [[] for _ in range(n_shards)]
+
+        for shard_index, (emigrants, west_ghosts, east_ghosts, shard_events, _) in enumerate(outputs):
+            for destination, agent in emigrants:
+                immigrants[destination].append(agent)
+            if shard_index > 0:
+                ghosts[shard_index - 1].extend(west_ghosts)
+            if shard_index < n_shards - 1:
+                ghosts[shard_index + 1].extend(east_ghosts)
+            for event in shard_events:
+                events[bisect.bisect_right(self.boundaries, event[2])].append(event)
+
+        reporters = [output[4] for output in outputs]
+        self.trash_on_street = sum(reporter["trash_on_street"] for reporter in reporters)
+        self.total_trash_produced = sum(reporter["total_trash_produced"] for reporter in reporters)
+        self.robot_disturbance = sum(reporter["robot_disturbance"] for reporter in reporters)
+        self.robot_present = any(reporter["robot_present"] for reporter in reporters)
+        self.agent_count_totals = {name: sum(reporter["agent_counts"][name] for reporter in reporters)
+                                   for name in reporters[0]["agent_counts"]}
+
+        return list(zip(immigrants, ghosts, events))
+
+    def step(self):
+        with self.publisher.phase("Shards"):
+            for connection, message in zip(self.connections, self.messages):
+                connection.send(message)
+            self.messages = self.merge([connection.recv() for connection in self.connections])
+
+        with self.publisher.phase("Data collection"):
+            # Collect data
+            self.datacollector.collect(self)
+        if self.publisher.due(self.steps):
+            self.publisher.publish(self, self.agent_count_totals, STEPS_IN_SECONDS)
+
+        if self.steps == self.full_simulation_time * STEPS_IN_HOUR:
+            self.running = False
+            self.close()
+            if self.save_logs:
+                timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # file name format: YYYY-MM-DD_HH-MM-SS
+                df = self.datacollector.get_model_vars_dataframe()
+                df.to_csv(f"logs\\{timestamp}.csv", index_label="Step")
+                self.heatmaps.export(f"logs\\{timestamp}_heatmaps.npz")
+
+    # Stop the shard processes, merge their heatmaps and close the telemetry sink
+    def close(self):
+        if not self.connections:
+            return
+        self.publisher.close()
+        for connection in self.connections:
+            connection.send(None)
+        for connection in self.connections:
+            for name, grid in connection.recv().items():
+                self.heatmaps.grids[name] += grid
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
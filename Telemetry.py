@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import json
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+
+# Maximum number of messages waiting to be sent, newer messages are dropped while the sink is behind
+MAX_PENDING = 100
+
+# Context of a phase that is not timed
+NOT_TIMED = contextlib.nullcontext()
+
+
+"""Sink of telemetry messages. Publishing never blocks the simulation: messages that cannot be delivered right away
+    are dropped and counted.
+"""
+class TelemetrySink:
+    def __init__(self):
+        self.dropped = 0
+
+    def publish(self, message):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+"""Sink that puts messages into an in-process queue, to be consumed by another thread of the process.
+
+    Args:
+        max_pending: Maximum number of messages in the queue
+"""
+class QueueSink(TelemetrySink):
+    def __init__(self, max_pending=MAX_PENDING):
+        super().__init__()
+        self.queue = queue.Queue(max_pending)
+
+    def publish(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+
+"""Sink that sends messages as JSON datagrams from an asyncio event loop in a background thread. The simulation only
+    hands a message over to the loop, encoding and sending happen in the background. Datagrams are sent whether
+    anyone listens or not, and a missing listener costs only the failed send in the background thread.
+
+    Args:
+        family: Address family of the socket
+        address: Address that datagrams are sent to
+        max_pending: Maximum number of messages waiting to be sent
+"""
+class DatagramSink(TelemetrySink):
+    def __init__(self, family, address, max_pending=MAX_PENDING):
+        super().__init__()
+        self.address = address
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+        self.loop = asyncio.new_event_loop()
+        self.pending = None
+        self.sender = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(max_pending), self.loop).result()
+
+    async def start(self, max_pending):
+        self.pending = asyncio.Queue(max_pending)
+        self.sender = asyncio.create_task(self.send_pending())
+
+    async def send_pending(self):
+        while True:
+            message = await self.pending.get()
+            data = json.dumps(message, default=float).encode()
+            try:
+                await self.loop.sock_sendto(self.socket, data, self.address)
+            except OSError:
+                # Nobody listens on the address or the datagram is too large
+                self.dropped += 1
+
+    def enqueue(self, message):
+        try:
+            self.pending.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def publish(self, message):
+        self.loop.call_soon_threadsafe(self.enqueue, message)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.sender.cancel)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.socket.close()
+
+
+# Sink that sends datagrams to given UDP host and port
+class UdpSink(DatagramSink):
+    def __init__(self, host="127.0.0.1", port=9999, max_pending=MAX_PENDING):
+        super().__init__(socket.AF_INET, (host, port), max_pending)
+
+
+# Sink that sends datagrams to given Unix socket
+class UnixSink(DatagramSink):
+    def __init__(self, path, max_pending=MAX_PENDING):
+        super().__init__(socket.AF_UNIX, path, max_pending)
+
+
+"""Publishes reporter values aggregated over an interval, ticks per second, agent counts and time spent in every
+    phase of a step to a telemetry sink. Without a sink phases are not timed and nothing is published.
+
+    Args:
+        sink: TelemetrySink to publish to, nothing is published if None
+        interval: Number of steps between two published messages
+"""
+class TelemetryPublisher:
+    def __init__(self, sink=None, interval=100):
+        self.sink = sink
+        self.interval = interval
+
+        # Time spent in every phase of a step since the last message, in seconds
+        self.phase_times = defaultdict(float)
+        self.last_step = 0
+        self.last_time = time.perf_counter()
+
+    # Context that times given phase of a step
+    def phase(self, name):
+        if self.sink is None:
+            return NOT_TIMED
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        yield
+        self.phase_times[name] += time.perf_counter() - start
+
+    def due(self, step):
+        return self.sink is not None and step % self.interval == 0
+
+    # Publish a message covering the steps since the last message. Reporter values are aggregated over the rows of
+    # the interval that are still in memory of the data collector
+    def publish(self, model, agent_counts, steps_in_second):
+        now = time.perf_counter()
+        steps = model.steps - self.last_step
+
+        reporters = {}
+        for name, values in model.datacollector.model_vars.items():
+            values = values[-steps:]
+            if values:
+                reporters[name] = {"mean": sum(values) / len(values), "min": min(values), "max": max(values)}
+
+        self.sink.publish({
+            "Step": model.steps,
+            "Simulated time (s)": model.steps / steps_in_second,
+            "Ticks per second": steps / max(now - self.last_time, 1e-9),
+            "Reporters": reporters,
+            "Agents": agent_counts,
+            "Phase times (s)": dict(self.phase_times),
+        })
+
+        self.phase_times.clear()
+        self.last_step = model.steps
+        self.last_time = now
+
+    # Close the sink when the run is finished
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()